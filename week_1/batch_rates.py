@@ -0,0 +1,110 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs
+
+from upstream import UpstreamError
+
+
+BATCH_PATH = 'rates'
+MAX_BASES = 32
+CONTENT_TYPE = 'application/x-ndjson'
+
+# Общий пул для параллельной загрузки баз; размер ограничивает запросы к внешнему API из одного батча
+executor = ThreadPoolExecutor(max_workers=MAX_BASES, thread_name_prefix='batch-rates')
+
+
+def _parse_codes(value, name):
+    codes = []
+    for code in value.split(','):
+        code = code.strip().upper()
+        if not code:
+            continue
+        if len(code) != 3 or not code.isalpha():
+            raise ValueError(f"Invalid currency code in {name}: {code}")
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+
+def parse_batch_query(query_string):
+    """
+    Разбирает ?bases=USD,EUR&symbols=RUB,GBP.
+
+    Возвращает список баз и множество валют для фильтрации (None - все).
+    При некорректном запросе бросает ValueError с текстом для клиента.
+    """
+    query = parse_qs(query_string)
+    bases = _parse_codes(','.join(query.get('bases', [])), 'bases')
+    if not bases:
+        raise ValueError("Parameter bases is required. Example: /rates?bases=USD,EUR")
+    if len(bases) > MAX_BASES:
+        raise ValueError(f"Too many bases: {len(bases)}, maximum is {MAX_BASES}")
+
+    symbols = None
+    if 'symbols' in query:
+        symbols = set(_parse_codes(','.join(query['symbols']), 'symbols'))
+    return bases, symbols
+
+
+def _line(data):
+    return json.dumps(data, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _rates_line(base, payload, symbols):
+    result = json.loads(payload.body)
+    rates = result.get('rates', {})
+    if symbols is not None:
+        rates = {code: rate for code, rate in rates.items() if code in symbols}
+    return _line({
+        "base": base,
+        "date": result.get('date'),
+        "time_last_updated": result.get('time_last_updated'),
+        "rates": rates,
+    })
+
+
+def _error_line(base, error):
+    if isinstance(error, UpstreamError):
+        return _line({"base": base, "error": True, "status_code": error.status_code, "message": error.message})
+    return _line({
+        "base": base, "error": True, "status_code": 500,
+        "message": f"Internal server error: {str(error)}"
+    })
+
+
+def stream_batch(bases, symbols, get_rates):
+    """
+    Загружает курсы для bases параллельно и отдаёт их строками NDJSON.
+
+    get_rates(currency_code) -> RatePayload - тот же источник, что и у обычного
+    маршрута, поэтому закэшированные базы приходят сразу, а остальные -
+    по мере ответа внешнего API. Ошибка одной базы не прерывает поток:
+    для неё отдаётся строка с error.
+    """
+    futures = {executor.submit(get_rates, base): base for base in bases}
+    for future in as_completed(futures):
+        base = futures[future]
+        try:
+            yield _rates_line(base, future.result(), symbols)
+        except Exception as e:
+            yield _error_line(base, e)
+
+
+async def astream_batch(bases, symbols, get_rates):
+    """То же, что stream_batch, для асинхронного get_rates: базы грузятся задачами event loop."""
+
+    async def load(base):
+        try:
+            return _rates_line(base, await get_rates(base), symbols)
+        except Exception as e:
+            return _error_line(base, e)
+
+    tasks = [asyncio.ensure_future(load(base)) for base in bases]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # Клиент отключился посреди потока: оставшиеся загрузки не нужны
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,274 @@
+"""
+Benchmarks for the caches in lru_cache.py against functools.lru_cache.
+
+Usage:
+python bench_lru_cache.py                 # all suites
+python bench_lru_cache.py compare --json  # one suite, machine-readable output
+python bench_lru_cache.py policies --trace keys.txt --maxsize 5000  # replay a recorded trace
+"""
+import argparse
+import functools
+import json
+import random
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+
+import lru_cache
+
+
+def ns_per_call(func, calls, repeat=5):
+	"""Best-of-repeat time of one call in nanoseconds."""
+	timer = timeit.Timer(func)
+	best = min(timer.repeat(repeat=repeat, number=1))
+	return best / calls * 1e9
+
+
+def bench_compare(size=100_000, maxsize=1024, keyspace=2048, seed=42):
+	"""Hits and mixed hit/miss traffic on a one-argument function."""
+	rng = random.Random(seed)
+	hot_keys = [rng.randrange(maxsize // 2) for _ in range(size)]
+	mixed_keys = [rng.randrange(keyspace) for _ in range(size)]
+
+	implementations = {
+		'functools': lambda: functools.lru_cache(maxsize=maxsize),
+		'lru_cache_v2': lambda: lru_cache.lru_cache_v2(maxsize=maxsize),
+		'lru_cache': lambda: lru_cache.lru_cache(maxsize=maxsize),
+	}
+
+	results = []
+	for name, make in implementations.items():
+		for workload, keys in (('hits', hot_keys), ('mixed', mixed_keys)):
+			cached = make()(lambda x: x)
+			for key in keys:
+				cached(key)
+
+			def run():
+				for key in keys:
+					cached(key)
+
+			results.append({
+				'suite': 'compare',
+				'implementation': name,
+				'workload': workload,
+				'ns_per_call': ns_per_call(run, len(keys)),
+			})
+	return results
+
+
+def bench_keys(size=50_000, maxsize=128):
+	"""ns/call of hits and misses for different call shapes on a trivial function."""
+	shapes = {
+		'one int': (lambda f, i: f(i), lambda a: a),
+		'one str': (lambda f, i: f(STRINGS[i]), lambda a: a),
+		'two args': (lambda f, i: f(i, 2), lambda a, b: a),
+		'kwargs': (lambda f, i: f(i, c=2, d=3), lambda a, c, d: a),
+	}
+	implementations = {
+		'functools': lambda: functools.lru_cache(maxsize=maxsize),
+		'lru_cache_v2': lambda: lru_cache.lru_cache_v2(maxsize=maxsize),
+		'lru_cache': lambda: lru_cache.lru_cache(maxsize=maxsize),
+	}
+
+	results = []
+	for name, make in implementations.items():
+		for shape, (call, func) in shapes.items():
+			cached = make()(func)
+			hit_keys = [index % (maxsize // 2) for index in range(size)]
+			# Distinct keys in a row: every call misses and evicts
+			miss_keys = list(range(size))
+
+			for workload, keys in (('hit', hit_keys), ('miss', miss_keys)):
+				for key in keys:
+					call(cached, key)
+
+				def run():
+					for key in keys:
+						call(cached, key)
+
+				results.append({
+					'suite': 'keys',
+					'implementation': name,
+					'workload': f'{shape} {workload}',
+					'ns_per_call': ns_per_call(run, len(keys)),
+				})
+	return results
+
+
+STRINGS = [f'key-{index}' for index in range(50_000)]
+
+
+def bench_threads(thread_counts=(1, 2, 4, 8), calls=50_000, maxsize=1024, keyspace=4096, seed=42):
+	"""Throughput of one decorated function called from several threads."""
+	rng = random.Random(seed)
+	keys = zipf_trace(rng, calls, keyspace)
+
+	implementations = {
+		'functools': lambda: functools.lru_cache(maxsize=maxsize),
+		'lru_cache': lambda: lru_cache.lru_cache(maxsize=maxsize),
+		'lru_cache_sharded': lambda: lru_cache.lru_cache(maxsize=maxsize, shards=16),
+	}
+
+	results = []
+	for name, make in implementations.items():
+		for thread_count in thread_counts:
+			cached = make()(lambda x: x)
+			barrier = threading.Barrier(thread_count + 1)
+
+			def worker(offset):
+				local_keys = keys[offset:] + keys[:offset]
+				barrier.wait()
+				for key in local_keys:
+					cached(key)
+
+			threads = [
+				threading.Thread(target=worker, args=(index * calls // thread_count,))
+				for index in range(thread_count)
+			]
+			for thread in threads:
+				thread.start()
+			barrier.wait()
+			started = time.perf_counter()
+			for thread in threads:
+				thread.join()
+			elapsed = time.perf_counter() - started
+
+			results.append({
+				'suite': 'threads',
+				'implementation': name,
+				'workload': f'{thread_count} threads',
+				'calls_per_sec': thread_count * calls / elapsed,
+			})
+	return results
+
+
+def zipf_trace(rng, size, keyspace, alpha=0.9):
+	weights = [1 / (rank + 1) ** alpha for rank in range(keyspace)]
+	return rng.choices(range(keyspace), weights=weights, k=size)
+
+
+def synthetic_traces(size=200_000, keyspace=20_000, maxsize=1000, seed=42):
+	"""Access patterns that separate the policies."""
+	rng = random.Random(seed)
+	scan_heavy = zipf_trace(rng, size, keyspace)
+	# A batch job sweeps 5x the cache over cold keys every 20k requests
+	for start in range(0, size, 20_000):
+		scan = [f'scan-{start}-{index}' for index in range(5 * maxsize)]
+		scan_heavy[start:start] = scan
+	return {
+		'zipf': zipf_trace(rng, size, keyspace),
+		'zipf+scans': scan_heavy,
+		# Cyclic access to slightly more keys than fit: the worst case for LRU
+		'loop': [index % int(maxsize * 1.2) for index in range(size)],
+	}
+
+
+def read_trace(path):
+	"""Recorded trace: one key per line."""
+	with open(path) as file:
+		return [line.rstrip('\n') for line in file if line.strip()]
+
+
+def bench_policies(traces=(), maxsize=1000):
+	"""Replays key traces through every policy; hit ratio and ns per access."""
+	workloads = {path: read_trace(path) for path in traces} or synthetic_traces(maxsize=maxsize)
+
+	results = []
+	for workload, trace in workloads.items():
+		for name, policy in lru_cache.POLICIES.items():
+			cache = policy(maxsize=maxsize)
+
+			def replay():
+				get, put = cache.get, cache.put
+				for key in trace:
+					if get(key, None) is None:
+						put(key, True)
+
+			elapsed = ns_per_call(replay, len(trace), repeat=1)
+			info = cache.info()
+			results.append({
+				'suite': 'policies',
+				'implementation': name,
+				'workload': workload,
+				'hit_ratio': info.hits / (info.hits + info.misses),
+				'ns_per_call': elapsed,
+			})
+	return results
+
+
+def rate_table_payload(rng, currencies=160):
+	"""Parsed exchange API response, the kind of value the proxies cache."""
+	return {
+		'base': 'USD',
+		'time_last_updated': rng.randrange(1 << 31),
+		'rates': {f'C{index:02d}': rng.uniform(0.01, 100) for index in range(currencies)},
+	}
+
+
+def bench_memory(entries=2000, maxbytes=4 * 1024 * 1024, seed=42):
+	"""How close the maxbytes accounting is to memory actually held."""
+	rng = random.Random(seed)
+	payloads = {
+		'bytes': lambda: rng.randbytes(rng.randrange(512, 8192)),
+		'rate_table': lambda: rate_table_payload(rng),
+	}
+
+	results = []
+	for workload, make in payloads.items():
+		for sizeof_name, sizeof in (('deep_sizeof', lru_cache.deep_sizeof), ('getsizeof', sys.getsizeof)):
+			tracemalloc.start()
+			cache = lru_cache.LRUCache(maxsize=None, maxbytes=maxbytes, sizeof=sizeof)
+			for key in range(entries):
+				cache.put(key, make())
+			traced, _ = tracemalloc.get_traced_memory()
+			tracemalloc.stop()
+			results.append({
+				'suite': 'memory',
+				'implementation': sizeof_name,
+				'workload': workload,
+				'entries': len(cache),
+				'accounted_mb': cache.currbytes / 1e6,
+				'traced_mb': traced / 1e6,
+			})
+	return results
+
+
+SUITES = {
+	'compare': bench_compare,
+	'memory': bench_memory,
+	'policies': bench_policies,
+	'threads': bench_threads,
+	'keys': bench_keys,
+}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('suites', nargs='*', default=list(SUITES), help=', '.join(SUITES))
+	parser.add_argument('--json', action='store_true', help='print results as JSON')
+	parser.add_argument('--trace', action='append', default=[], help='key trace for policies, one key per line')
+	parser.add_argument('--maxsize', type=int, default=1000, help='cache size for policies')
+	args = parser.parse_args()
+
+	options = {
+		'policies': {'traces': args.trace, 'maxsize': args.maxsize},
+	}
+	results = []
+	for suite in args.suites:
+		results.extend(SUITES[suite](**options.get(suite, {})))
+
+	if args.json:
+		json.dump(results, sys.stdout, indent=2)
+		print()
+		return
+	for result in results:
+		print('  '.join(
+			f'{value:12.3f}' if isinstance(value, float) else f'{value!s:<16}'
+			for value in result.values()
+		))
+
+
+if __name__ == '__main__':
+	main()
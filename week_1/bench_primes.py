@@ -0,0 +1,241 @@
+"""
+Reproducible benchmark of the prime-checking solutions in parallel_processing.py.
+
+Data sets are generated from a fixed seed; every solution gets warm-up
+runs and then repeated timed runs reported as median and IQR, along with
+the machine and engine settings that affect them. Charts are a separate
+step, so runs need no display and no matplotlib.
+
+Usage:
+python bench_primes.py run --sizes 1000,10000,100000 --output primes.json
+python bench_primes.py run --range 1000000000000,1000000000000000000 --check is_prime_miller_rabin
+python bench_primes.py run --baseline primes.json --tolerance 0.2   # exit code 1 on regression
+python bench_primes.py plot primes.json --output primes             # primes_lines.png, primes_bars.png
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import parallel_processing
+
+
+CHECKS = {
+    'is_prime': parallel_processing.is_prime,
+    'is_prime_miller_rabin': parallel_processing.is_prime_miller_rabin,
+}
+
+CSV_FIELDS = ('solution', 'check', 'n', 'median_s', 'iqr_s', 'min_s', 'max_s', 'repeat', 'plan')
+
+
+def environment():
+    """Settings that make timings comparable between runs."""
+    import numpy
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'engine_processes': parallel_processing.engine.processes,
+        'stream_chunk_size': parallel_processing.STREAM_CHUNK_SIZE,
+    }
+
+
+def summarize(samples):
+    if len(samples) > 1:
+        q1, _, q3 = statistics.quantiles(samples, n=4, method='inclusive')
+    else:
+        q1 = q3 = samples[0]
+    return {
+        'median_s': statistics.median(samples),
+        'iqr_s': q3 - q1,
+        'min_s': min(samples),
+        'max_s': max(samples),
+    }
+
+
+def bench(solutions, sizes, low, high, check_name, repeat, warmup, seed):
+    check = CHECKS[check_name]
+    results = []
+    for n in sizes:
+        data_set = list(parallel_processing.generate_data(n, low, high, seed=seed))
+        for name in solutions:
+            for _ in range(warmup):
+                if not parallel_processing.run_solution(name, n, data_set, check):
+                    break
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if not parallel_processing.run_solution(name, n, data_set, check):
+                    break
+                samples.append(time.perf_counter() - started)
+            if not samples:
+                continue
+
+            result = {'solution': name, 'check': check_name, 'n': n, 'repeat': repeat}
+            result.update(summarize(samples))
+            result['samples'] = samples
+            # How the adaptive engine ran it: (mode, chunksize)
+            result['plan'] = parallel_processing.engine.last_plan if name == 'adaptive_pool_solution' else None
+            results.append(result)
+            print(
+                f"{name:<35} {check_name:<22} n={n:<10} median {result['median_s']:.6f} s  "
+                f"IQR {result['iqr_s']:.6f} s",
+                file=sys.stderr
+            )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints median changes against baseline; returns the regressed entries."""
+    previous = {(item['solution'], item['check'], item['n']): item for item in baseline['results']}
+    regressions = []
+    for item in results:
+        old = previous.get((item['solution'], item['check'], item['n']))
+        if old is None:
+            continue
+        change = item['median_s'] / old['median_s'] - 1
+        # Slower by more than tolerance and by more than the old run's own spread
+        regressed = change > tolerance and item['median_s'] - old['median_s'] > old['iqr_s']
+        if regressed:
+            regressions.append(item)
+        print(
+            f"{item['solution']:<35} n={item['n']:<10} {old['median_s']:.6f} -> {item['median_s']:.6f} s "
+            f"({change:+.1%}){'  REGRESSION' if regressed else ''}",
+            file=sys.stderr
+        )
+    return regressions
+
+
+def write_csv(path, results):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def plot(report, prefix):
+    """Renders the charts of a saved report into PNG files."""
+    # Imported here: runs on machines without matplotlib or a display
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import numpy as np
+
+    series = {}
+    for item in report['results']:
+        label = item['solution'] if item['check'] == 'is_prime' else f"{item['solution']}[{item['check']}]"
+        series.setdefault(label, []).append(item)
+    for items in series.values():
+        items.sort(key=lambda item: item['n'])
+
+    plt.figure(figsize=(12, 8))
+    markers = ['o', 's', '^', '*', 'D', 'v', 'P', 'X']
+    for idx, (label, items) in enumerate(sorted(series.items())):
+        sizes = [item['n'] for item in items]
+        medians = [item['median_s'] for item in items]
+        spreads = [item['iqr_s'] / 2 for item in items]
+        plt.errorbar(sizes, medians, yerr=spreads, label=label.replace('_', ' ').title(),
+                     marker=markers[idx % len(markers)], linewidth=2, markersize=8, capsize=4)
+    plt.xscale('log')
+    plt.yscale('log')
+    plt.xlabel('Input Size', fontsize=14)
+    plt.ylabel('Median Execution Time (seconds)', fontsize=14)
+    plt.title('Performance Comparison of Parallelization Methods', fontsize=16, fontweight='bold')
+    plt.grid(True, which="both", ls="--", alpha=0.3)
+    plt.legend(fontsize=10)
+    plt.tight_layout()
+    plt.savefig(f'{prefix}_lines.png')
+    plt.close()
+
+    plt.figure(figsize=(14, 8))
+    unique_sizes = sorted({item['n'] for item in report['results']})
+    x = np.arange(len(unique_sizes))
+    width = 0.8 / max(len(series), 1)
+    for idx, (label, items) in enumerate(sorted(series.items())):
+        by_size = {item['n']: item['median_s'] for item in items}
+        positions = x + (idx - (len(series) - 1) / 2) * width
+        plt.bar(positions, [by_size.get(size, 0) for size in unique_sizes], width,
+                label=label.replace('_', ' ').title(), alpha=0.8)
+    plt.xlabel('Input Size', fontsize=14)
+    plt.ylabel('Median Execution Time (seconds)', fontsize=14)
+    plt.title('Performance Comparison - Grouped Bar Chart', fontsize=16, fontweight='bold')
+    plt.xticks(x, [str(size) for size in unique_sizes])
+    plt.yscale('log')
+    plt.legend(fontsize=10)
+    plt.grid(True, axis='y', alpha=0.3, linestyle='--')
+    plt.tight_layout()
+    plt.savefig(f'{prefix}_bars.png')
+    plt.close()
+    return [f'{prefix}_lines.png', f'{prefix}_bars.png']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='time the solutions')
+    run.add_argument('--solutions', default=','.join(parallel_processing.SOLUTIONS),
+                     help='comma-separated names from parallel_processing.SOLUTIONS')
+    run.add_argument('--sizes', default='1000,10000,100000', help='comma-separated n values')
+    run.add_argument('--range', default='1,1000', help='low,high of the generated numbers')
+    run.add_argument('--check', choices=CHECKS, default='is_prime')
+    run.add_argument('--repeat', type=int, default=5, help='timed runs per solution and size')
+    run.add_argument('--warmup', type=int, default=1, help='untimed runs before timing')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--output', help='JSON report path (default: stdout)')
+    run.add_argument('--csv', help='also write a CSV summary here')
+    run.add_argument('--baseline', help='JSON report of a previous run to compare with')
+    run.add_argument('--tolerance', type=float, default=0.1, help='allowed median slowdown, 0.1 = 10%%')
+
+    charts = commands.add_parser('plot', help='render charts from a JSON report')
+    charts.add_argument('report')
+    charts.add_argument('--output', default='primes', help='file name prefix for the PNG files')
+
+    args = parser.parse_args()
+
+    if args.command == 'plot':
+        with open(args.report) as file:
+            for path in plot(json.load(file), args.output):
+                print(path)
+        return
+
+    solutions = args.solutions.split(',')
+    unknown = set(solutions) - set(parallel_processing.SOLUTIONS)
+    if unknown:
+        parser.error(f"unknown solutions: {', '.join(sorted(unknown))}")
+    low, high = map(int, args.range.split(','))
+
+    # Pool startup is paid here once instead of inside the first timing
+    parallel_processing.engine.start()
+    results = bench(
+        solutions, [int(size) for size in args.sizes.split(',')], low, high,
+        args.check, args.repeat, args.warmup, args.seed
+    )
+    report = {'config': vars(args), 'environment': environment(), 'results': results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.csv:
+        write_csv(args.csv, results)
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
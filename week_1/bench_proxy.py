@@ -0,0 +1,279 @@
+"""
+Нагрузочный бенчмарк прокси курсов валют без выхода в сеть.
+
+Поднимает локальную заглушку exchangerate-api с настраиваемой задержкой,
+долей ошибок и размером таблицы курсов, направляет на неё wsgi_app
+(currency_proxy) и CurrencyProxyHandler (exchange_proxy), нагружает их
+с заданной конкурентностью и печатает результаты в JSON.
+
+Пример:
+python bench_proxy.py --targets wsgi,exchange --concurrency 1,16,64 --duration 5 --output bench.json
+python bench_proxy.py --baseline bench.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import string
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import product
+from multiprocessing import Process, Queue
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+def currency_codes(count):
+    """Первые count кодов: реальные популярные, дальше синтетические AAA, AAB..."""
+    popular = ['USD', 'EUR', 'GBP', 'JPY', 'RUB', 'CNY', 'CHF', 'CAD', 'AUD', 'SEK']
+    synthetic = (''.join(chars) for chars in product(string.ascii_uppercase, repeat=3))
+    codes = popular[:count]
+    for code in synthetic:
+        if len(codes) >= count:
+            break
+        if code not in codes:
+            codes.append(code)
+    return codes
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Заглушка /v4/latest/<CODE> внешнего API."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+    error_rate = 0.0
+    rates = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        code = self.path.rstrip('/').rsplit('/', 1)[-1].upper()
+        if random.random() < self.error_rate:
+            status, data = 503, {"result": "error", "error-type": "unavailable"}
+        elif code not in self.rates:
+            status, data = 200, {"result": "error", "error": "Invalid base currency"}
+        else:
+            pivot = self.rates[code]
+            status, data = 200, {
+                "provider": "https://www.exchangerate-api.com",
+                "base": code,
+                "date": time.strftime('%Y-%m-%d'),
+                "time_last_updated": int(time.time()),
+                "rates": {other: round(rate / pivot, 6) for other, rate in self.rates.items()},
+            }
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_stub(ready, latency, error_rate, payload_size):
+    rng = random.Random(42)
+    StubHandler.latency = latency
+    StubHandler.error_rate = error_rate
+    StubHandler.rates = {code: rng.uniform(0.01, 100) for code in currency_codes(payload_size)}
+    StubHandler.rates['USD'] = 1.0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def run_target(ready, target, api_url, env):
+    # Настройки прокси читаются из окружения при импорте
+    os.environ.update(env)
+    os.environ['EXCHANGE_API_URL'] = api_url
+
+    if target == 'wsgi':
+        import currency_proxy
+        server = make_server(
+            '127.0.0.1', 0, currency_proxy.wsgi_app,
+            server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler
+        )
+    else:
+        import exchange_proxy
+        exchange_proxy.CurrencyProxyHandler.log_message = lambda self, format, *args: None
+        exchange_proxy.CurrencyProxyHandler.rate_cache.ttl = float(env['CURRENCY_CACHE_TTL'])
+        if env['CURRENCY_RATES_MODE'] == 'snapshot':
+            # exchange_proxy не читает режим из окружения: включаем снимок, как run_server(snapshot=True)
+            exchange_proxy.CurrencyProxyHandler.rate_table = exchange_proxy.RateTable(
+                exchange_proxy.fetch_rates, refresh_interval=float(env['CURRENCY_CACHE_TTL'])
+            )
+        server = exchange_proxy.PooledHTTPServer(
+            ('127.0.0.1', 0), exchange_proxy.CurrencyProxyHandler, workers=int(env['BENCH_WORKERS'])
+        )
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def start(target, *args):
+    ready = Queue()
+    process = Process(target=target, args=(ready,) + args, daemon=True)
+    process.start()
+    return process, ready.get(timeout=30)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def drive(port, codes, concurrency, duration):
+    """
+    Нагружает прокси concurrency клиентами с keep-alive в течение duration секунд.
+
+    Клиент ждёт ответа перед следующим запросом, поэтому клиент, которого
+    не обслуживают, даёт одну точку в латентностях и почти не влияет на
+    перцентили. Такое голодание видно по числу запросов каждого клиента.
+    """
+    latencies = []
+    statuses = {}
+    client_requests = [0] * concurrency
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local_latencies = []
+        local_statuses = {}
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request('GET', '/' + rng.choice(codes))
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                if response.will_close:
+                    conn.close()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status = 'error'
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        conn.close()
+        client_requests[seed] = len(local_latencies)
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ok = statuses.get(200, 0)
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'errors': len(latencies) - ok,
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'duration': elapsed,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'client_requests': client_requests,
+        'client_requests_min': min(client_requests),
+        'client_requests_max': max(client_requests),
+    }
+
+
+def compare(results, baseline):
+    """Печатает изменение rps и p99 относительно сохранённого прогона."""
+    previous = {(item['target'], item['concurrency']): item for item in baseline['results']}
+    for item in results['results']:
+        old = previous.get((item['target'], item['concurrency']))
+        if old is None:
+            continue
+        print(
+            f"{item['target']:<10} c={item['concurrency']:<5} "
+            f"rps {old['rps']:10.1f} -> {item['rps']:10.1f} ({item['rps'] / old['rps'] - 1:+.1%})  "
+            f"p99 {old['p99_ms']:8.2f} -> {item['p99_ms']:8.2f} ms",
+            file=sys.stderr
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', default='wsgi,exchange', help='wsgi и/или exchange через запятую')
+    parser.add_argument('--concurrency', default='1,8,32', help='уровни конкурентности через запятую')
+    parser.add_argument('--duration', type=float, default=5.0, help='секунд на каждый прогон')
+    parser.add_argument('--latency', type=float, default=0.2, help='задержка заглушки, с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503 от заглушки')
+    parser.add_argument('--payload-size', type=int, default=160, help='число валют в таблице курсов')
+    parser.add_argument('--codes', type=int, default=10, help='сколько разных валют запрашивают клиенты')
+    parser.add_argument('--cache-ttl', type=float, default=60.0, help='TTL кэша прокси, 0 - без кэша')
+    parser.add_argument('--mode', choices=('cache', 'snapshot'), default='cache')
+    parser.add_argument('--workers', type=int, default=32, help='потоков у exchange_proxy')
+    parser.add_argument('--output', help='куда сохранить JSON (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args()
+
+    stub, stub_port = start(run_stub, args.latency, args.error_rate, args.payload_size)
+    api_url = f'http://127.0.0.1:{stub_port}/v4/latest/{{}}'
+    env = {
+        'CURRENCY_CACHE_TTL': str(args.cache_ttl),
+        'CURRENCY_CACHE_STALE_TTL': '0',
+        'CURRENCY_RATES_MODE': args.mode,
+        'BENCH_WORKERS': str(args.workers),
+    }
+    codes = currency_codes(min(args.codes, args.payload_size))
+
+    results = []
+    for target in args.targets.split(','):
+        for concurrency in map(int, args.concurrency.split(',')):
+            # Для каждого прогона свежий процесс прокси с холодным кэшем
+            process, port = start(run_target, target, api_url, env)
+            result = drive(port, codes, concurrency, args.duration)
+            process.terminate()
+            process.join()
+            result.update(target=target, concurrency=concurrency)
+            results.append(result)
+            print(
+                f"{target:<10} c={concurrency:<5} {result['rps']:10.1f} rps  "
+                f"p50 {result['p50_ms'] or 0:8.2f}  p95 {result['p95_ms'] or 0:8.2f}  "
+                f"p99 {result['p99_ms'] or 0:8.2f} ms  errors {result['errors']}  "
+                f"per client {result['client_requests_min']}..{result['client_requests_max']}",
+                file=sys.stderr
+            )
+    stub.terminate()
+
+    report = {'config': vars(args), 'results': results}
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(report, json.load(file))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,113 +1,184 @@
 import json
-import requests
+import os
+from http import HTTPStatus
+
+import batch_rates
+import proxy_metrics
+from rate_cache import RateCache
+from rate_payload import RatePayload
+from rate_table import RateTable
+from shared_rate_cache import SharedRateCache
+from upstream import UpstreamError, fetch_rates
+
+
+# Сколько секунд курсы считаются свежими и сколько ещё отдаются, пока идёт фоновое обновление
+CACHE_TTL = float(os.environ.get('CURRENCY_CACHE_TTL', 60))
+CACHE_STALE_TTL = float(os.environ.get('CURRENCY_CACHE_STALE_TTL', 300))
+
+# cache - кэшировать ответ внешнего API для каждой валюты,
+# snapshot - загружать раз в CURRENCY_CACHE_TTL секунд только опорную валюту и считать остальные локально
+RATES_MODE = os.environ.get('CURRENCY_RATES_MODE', 'cache')
+REFERENCE_CURRENCY = os.environ.get('CURRENCY_REFERENCE', 'USD')
+
+# Путь к файлу общего кэша воркеров, например /dev/shm/currency_proxy.cache;
+# если не задан, у каждого процесса свой кэш
+SHARED_CACHE_PATH = os.environ.get('CURRENCY_SHARED_CACHE')
+
+HEADERS = [
+    ('Content-Type', 'application/json'),
+    ('Access-Control-Allow-Origin', '*')
+]
+
+
+class BadRequest(Exception):
+    """Некорректный запрос клиента."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def error_body(status_code, message):
+    """Формирует JSON с ошибкой."""
+    return json.dumps({
+        "error": True,
+        "status_code": status_code,
+        "message": message
+    }).encode('utf-8')
+
+
+def load_payload(currency_code):
+    """Загружает курсы и готовит ответ для кэша."""
+    return RatePayload(fetch_rates(currency_code))
+
+
+if SHARED_CACHE_PATH:
+    rate_cache = SharedRateCache(
+        SHARED_CACHE_PATH, fetch_rates, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, wrap=RatePayload,
+        on_lookup=proxy_metrics.cache_lookup
+    )
+    # Снимок опорной валюты тоже берём из общего кэша: один запрос на хост, а не на воркер
+    rate_table = RateTable(
+        lambda currency_code: rate_cache.get(currency_code).body,
+        reference=REFERENCE_CURRENCY, refresh_interval=CACHE_TTL
+    )
+else:
+    rate_cache = RateCache(
+        load_payload, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, on_lookup=proxy_metrics.cache_lookup
+    )
+    rate_table = RateTable(fetch_rates, reference=REFERENCE_CURRENCY, refresh_interval=CACHE_TTL)
+
+
+def parse_currency_code(method, path):
+    """Проверяет метод и путь запроса и возвращает код валюты."""
+    if method != 'GET':
+        raise BadRequest(405, "Method Not Allowed")
+
+    path = path.strip('/')
+    if not path:
+        raise BadRequest(400, "Currency code is required. Example: /USD")
+
+    currency_code = path.split('/')[0].upper()
+    if len(currency_code) != 3 or not currency_code.isalpha():
+        raise BadRequest(400, f"Invalid currency code: {currency_code}")
+    return currency_code
+
+
+def get_rates(currency_code):
+    """Возвращает RatePayload с курсами для currency_code."""
+    if RATES_MODE == 'snapshot':
+        payload = rate_table.rate_payload(currency_code)
+        if payload is None:
+            raise UpstreamError(404, f"Currency not found: {currency_code}")
+        return payload
+    return rate_cache.get(currency_code)
+
+
+def respond(start_response, status_code, body):
+    """Отправляет готовое тело ответа."""
+    start_response(
+        f'{status_code} {HTTPStatus(status_code).phrase}',
+        HEADERS + [('Content-Length', str(len(body)))]
+    )
+    return [body]
+
+
+def respond_rates(environ, start_response, payload):
+    """Отправляет курсы с учётом Accept-Encoding и условных заголовков."""
+    status_code, headers, body = payload.response(
+        environ.get('HTTP_ACCEPT_ENCODING'),
+        environ.get('HTTP_IF_NONE_MATCH'),
+        environ.get('HTTP_IF_MODIFIED_SINCE'),
+    )
+    start_response(f'{status_code} {HTTPStatus(status_code).phrase}', HEADERS + headers)
+    return [body]
+
+
+def batch_app(environ, start_response):
+    """Отдаёт курсы нескольких баз потоком NDJSON: /rates?bases=USD,EUR&symbols=RUB."""
+    try:
+        bases, symbols = batch_rates.parse_batch_query(environ.get('QUERY_STRING', ''))
+    except ValueError as e:
+        return respond(start_response, 400, error_body(400, str(e)))
+
+    # Без Content-Length сервер отправит строки клиенту по мере готовности
+    start_response('200 OK', [
+        ('Content-Type', batch_rates.CONTENT_TYPE),
+        ('Access-Control-Allow-Origin', '*')
+    ])
+    return batch_rates.stream_batch(bases, symbols, get_rates)
 
 
 # WSGI-совместимое приложение для использования с Gunicorn и другими WSGI-серверами
+@proxy_metrics.instrument_wsgi
 def wsgi_app(environ, start_response):
     """
     WSGI-приложение для проксирования курсов валют.
-    
+
+    Курсы кэшируются в памяти процесса на CURRENCY_CACHE_TTL секунд
+    (или в общем для всех воркеров файле CURRENCY_SHARED_CACHE),
+    одновременные запросы одной валюты делят один запрос к внешнему API,
+    который идёт через общий пул keep-alive соединений upstream.client.
+    В режиме CURRENCY_RATES_MODE=snapshot все базы считаются из одного
+    снимка опорной валюты. Несколько баз сразу отдаёт /rates?bases=...
+
+    Ответы с курсами несут ETag и Last-Modified (If-None-Match и
+    If-Modified-Since дают 304) и сжимаются gzip/deflate один раз на
+    запись кэша. Метрики процесса отдаются на /metrics.
+
     Использование:
     gunicorn currency_proxy:wsgi_app
     waitress-serve --listen=*:8000 currency_proxy:application
     """
-    my_headers = [
-            ('Content-Type', 'application/json'),
-            ('Access-Control-Allow-Origin', '*')
-    ]
-
-    # Определяем метод запроса
     method = environ.get('REQUEST_METHOD', 'GET')
-    if method != 'GET':
-        start_response('405 Method Not Allowed', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 405,
-            "message": "Method Not Allowed"
-        }).encode('utf-8')]
-    
-    # Извлекаем путь
-    path = environ.get('PATH_INFO', '').strip('/')
-    if not path:
-        start_response('400 Bad Request', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 400,
-            "message": "Currency code is required. Example: /USD"
-        }).encode('utf-8')]
-    
-    # Извлекаем код валюты
-    currency_code = path.split('/')[0].upper()
-    if len(currency_code) != 3 or not currency_code.isalpha():
-        start_response('400 Bad Request', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 400,
-            "message": f"Invalid currency code: {currency_code}"
-        }).encode('utf-8')]
-    
+    path = environ.get('PATH_INFO', '')
+    if method == 'GET' and path.strip('/') == batch_rates.BATCH_PATH:
+        return batch_app(environ, start_response)
+    if method == 'GET' and path.strip('/') == proxy_metrics.METRICS_PATH:
+        body = proxy_metrics.REGISTRY.render()
+        start_response('200 OK', [
+            ('Content-Type', proxy_metrics.CONTENT_TYPE),
+            ('Content-Length', str(len(body)))
+        ])
+        return [body]
+
     try:
-        # Запрос к внешнему API
-        url = f"https://api.exchangerate-api.com/v4/latest/{currency_code}"
-        headers = {'User-Agent': 'CurrencyProxy/1.0'}
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        
-        # Проверяем статус ответа
-        if response.status_code == 404:
-            start_response('404 Not Found', my_headers)
-            return [json.dumps({
-                "error": True,
-                "status_code": 404,
-                "message": f"Currency not found: {currency_code}"
-            }).encode('utf-8')]
-        
-        # Проверяем, не является ли ответ ошибкой
-        try:
-            result = response.json()
-            if 'error' in result and result['error'] == 'Invalid base currency':
-                start_response('404 Not Found', my_headers)
-                return [json.dumps({
-                    "error": True,
-                    "status_code": 404,
-                    "message": f"Currency not found: {currency_code}"
-                }).encode('utf-8')]
-        except json.JSONDecodeError:
-            pass
-        
-        # Отправляем успешный ответ
-        start_response(f'{response.status_code} OK', my_headers)
-        return [response.content]
-        
-    except requests.exceptions.Timeout:
-        start_response('504 Gateway Timeout', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 504,
-            "message": "Request to exchange rate API timed out"
-        }).encode('utf-8')]
-    except requests.exceptions.ConnectionError:
-        start_response('502 Bad Gateway', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 502,
-            "message": "Cannot connect to exchange rate API"
-        }).encode('utf-8')]
-    except requests.exceptions.RequestException as e:
-        start_response('502 Bad Gateway', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 502,
-            "message": f"Error connecting to exchange rate API: {str(e)}"
-        }).encode('utf-8')]
+        currency_code = parse_currency_code(method, path)
+    except BadRequest as e:
+        return respond(start_response, e.status_code, error_body(e.status_code, e.message))
+
+    try:
+        # Закэшированный ответ отдаётся без повторной сериализации и сжатия
+        payload = get_rates(currency_code)
+    except UpstreamError as e:
+        return respond(start_response, e.status_code, error_body(e.status_code, e.message))
     except Exception as e:
-        start_response('500 Internal Server Error', my_headers)
-        return [json.dumps({
-            "error": True,
-            "status_code": 500,
-            "message": f"Internal server error: {str(e)}"
-        }).encode('utf-8')]
+        return respond(start_response, 500, error_body(500, f"Internal server error: {str(e)}"))
+
+    # Отправляем успешный ответ или 304, если у клиента актуальная версия
+    return respond_rates(environ, start_response, payload)
 
 
 # Для совместимости с WSGI серверами
-application = wsgi_app
\ No newline at end of file
+application = wsgi_app
@@ -0,0 +1,213 @@
+import asyncio
+import os
+
+import aiohttp
+
+import batch_rates
+from currency_proxy import (
+    CACHE_STALE_TTL, CACHE_TTL, HEADERS, RATES_MODE, BadRequest, error_body,
+    parse_currency_code, rate_table
+)
+import proxy_metrics
+from proxy_metrics import UpstreamTimer
+from rate_cache import AsyncRateCache
+from rate_payload import RatePayload
+from upstream import (
+    API_HEADERS, API_URL, CONNECT_TIMEOUT, READ_TIMEOUT, UpstreamError, check_rates_response
+)
+
+
+# Сколько соединений к внешнему API может держать один процесс
+MAX_UPSTREAM_CONNECTIONS = int(os.environ.get('ASGI_UPSTREAM_CONNECTIONS', 1000))
+
+ASGI_HEADERS = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in HEADERS]
+
+_session = None
+
+
+def get_session():
+    """Общая aiohttp-сессия процесса; создаётся внутри работающего event loop."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=MAX_UPSTREAM_CONNECTIONS,
+                limit_per_host=MAX_UPSTREAM_CONNECTIONS,
+                ttl_dns_cache=300,
+            ),
+            timeout=aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            headers=API_HEADERS,
+        )
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def fetch_rates(currency_code):
+    """Асинхронно запрашивает курсы у внешнего API и возвращает тело ответа в байтах."""
+    try:
+        with UpstreamTimer():
+            async with get_session().get(API_URL.format(currency_code)) as response:
+                body = await response.read()
+    except asyncio.TimeoutError:
+        raise UpstreamError(504, "Request to exchange rate API timed out")
+    except aiohttp.ClientError as e:
+        raise UpstreamError(502, f"Cannot connect to exchange rate API: {str(e)}")
+
+    return check_rates_response(currency_code, response.status, body)
+
+
+async def load_payload(currency_code):
+    """Загружает курсы и готовит ответ для кэша."""
+    return RatePayload(await fetch_rates(currency_code))
+
+
+rate_cache = AsyncRateCache(
+    load_payload, ttl=CACHE_TTL, stale_ttl=CACHE_STALE_TTL, on_lookup=proxy_metrics.cache_lookup
+)
+
+
+async def get_rates(currency_code):
+    """Возвращает RatePayload с курсами для currency_code."""
+    if RATES_MODE == 'snapshot':
+        if rate_table.ready:
+            payload = rate_table.rate_payload(currency_code)
+        else:
+            # Первый снимок загружается синхронно, не блокируем им event loop
+            payload = await asyncio.to_thread(rate_table.rate_payload, currency_code)
+        if payload is None:
+            raise UpstreamError(404, f"Currency not found: {currency_code}")
+        return payload
+    return await rate_cache.get(currency_code)
+
+
+async def respond(send, status_code, body, headers=ASGI_HEADERS):
+    """Отправляет готовое тело ответа."""
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': headers + [(b'content-length', str(len(body)).encode('latin-1'))],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def respond_rates(scope, send, payload):
+    """Отправляет курсы с учётом Accept-Encoding и условных заголовков."""
+    request_headers = dict(scope['headers'])
+    status_code, headers, body = payload.response(
+        request_headers.get(b'accept-encoding', b'').decode('latin-1'),
+        request_headers.get(b'if-none-match', b'').decode('latin-1'),
+        request_headers.get(b'if-modified-since', b'').decode('latin-1'),
+    )
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': ASGI_HEADERS + [
+            (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def respond_batch(scope, send):
+    """Отдаёт курсы нескольких баз потоком NDJSON: /rates?bases=USD,EUR&symbols=RUB."""
+    try:
+        bases, symbols = batch_rates.parse_batch_query(scope['query_string'].decode('latin-1'))
+    except ValueError as e:
+        await respond(send, 400, error_body(400, str(e)))
+        return
+
+    # Без content-length сервер отправит строки клиенту по мере готовности
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', batch_rates.CONTENT_TYPE.encode('latin-1')),
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+    async for line in batch_rates.astream_batch(bases, symbols, get_rates):
+        await send({'type': 'http.response.body', 'body': line, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_session()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_session()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def asgi_app(scope, receive, send):
+    """
+    ASGI-приложение для проксирования курсов валют.
+
+    Маршруты, проверки и JSON ошибок совпадают с currency_proxy.wsgi_app,
+    но запросы к внешнему API не блокируют процесс: один воркер держит
+    тысячи одновременных запросов через общую aiohttp-сессию.
+    Метрики процесса отдаются на /metrics.
+
+    Использование:
+    uvicorn currency_proxy_asgi:asgi_app
+    gunicorn -k uvicorn.workers.UvicornWorker currency_proxy_asgi:application
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    timer = proxy_metrics.RequestTimer(proxy_metrics.route_label(scope['path']))
+    status = [500]
+
+    async def recording_send(message):
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+        await send(message)
+
+    try:
+        await handle(scope, recording_send)
+    finally:
+        timer.finish(status[0])
+
+
+async def handle(scope, send):
+    """Маршрутизирует HTTP запрос."""
+    if scope['method'] == 'GET' and scope['path'].strip('/') == batch_rates.BATCH_PATH:
+        await respond_batch(scope, send)
+        return
+    if scope['method'] == 'GET' and scope['path'].strip('/') == proxy_metrics.METRICS_PATH:
+        await respond(send, 200, proxy_metrics.REGISTRY.render(), [
+            (b'content-type', proxy_metrics.CONTENT_TYPE.encode('latin-1'))
+        ])
+        return
+
+    try:
+        currency_code = parse_currency_code(scope['method'], scope['path'])
+    except BadRequest as e:
+        await respond(send, e.status_code, error_body(e.status_code, e.message))
+        return
+
+    try:
+        payload = await get_rates(currency_code)
+    except UpstreamError as e:
+        await respond(send, e.status_code, error_body(e.status_code, e.message))
+        return
+    except Exception as e:
+        await respond(send, 500, error_body(500, f"Internal server error: {str(e)}"))
+        return
+
+    # Отправляем успешный ответ или 304, если у клиента актуальная версия
+    await respond_rates(scope, send, payload)
+
+
+# Для совместимости с ASGI серверами
+application = asgi_app
@@ -0,0 +1,222 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+
+# Values are stored as-is when they are bytes, pickled otherwise
+RAW, PICKLED = 0, 1
+
+# Errors of pickling arbitrary arguments and return values
+_PICKLE_ERRORS = (pickle.PicklingError, TypeError, AttributeError)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+	namespace TEXT NOT NULL,
+	key BLOB NOT NULL,
+	kind INTEGER NOT NULL,
+	value BLOB NOT NULL,
+	size INTEGER NOT NULL,
+	expires REAL,
+	used REAL NOT NULL,
+	PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+'''
+
+
+class DiskStore:
+	"""
+	Second cache tier in an sqlite file.
+
+	Entries evicted from memory are written here and read back on a
+	memory miss, so they survive restarts. Several functions and
+	processes can share one file: entries are separated by namespace,
+	and sqlite serializes writers.
+
+	Every write is one transaction in WAL mode, so a crash loses at
+	most the last write but never leaves a corrupt file. Once the
+	stored values exceed maxbytes (None: no limit), least recently used
+	rows are deleted.
+	"""
+
+	def __init__(self, path, maxbytes=64 * 1024 * 1024):
+		self.path = path
+		self.maxbytes = maxbytes
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		directory = os.path.dirname(os.path.abspath(path))
+		os.makedirs(directory, exist_ok=True)
+		self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+		self._db.execute('PRAGMA journal_mode=WAL')
+		self._db.execute('PRAGMA synchronous=NORMAL')
+		self._db.executescript(_SCHEMA)
+		self.currbytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+	def get(self, namespace, key, default=None):
+		entry = self.get_entry(namespace, key)
+		return default if entry is None else entry[0]
+
+	def get_entry(self, namespace, key):
+		"""(value, seconds left or None) for a live entry, else None."""
+		try:
+			key_blob = _dumps_key(key)
+		except _PICKLE_ERRORS:
+			return None
+		now = time.time()
+		with self._lock:
+			if self._db is None:
+				return None
+			row = self._db.execute(
+				'SELECT kind, value, expires FROM entries WHERE namespace = ? AND key = ?',
+				(namespace, key_blob)
+			).fetchone()
+			if row is None or (row[2] is not None and row[2] <= now):
+				self.misses += 1
+				return None
+			self._db.execute(
+				'UPDATE entries SET used = ? WHERE namespace = ? AND key = ?', (now, namespace, key_blob)
+			)
+		self.hits += 1
+		return _loads_value(row[0], row[1]), None if row[2] is None else row[2] - now
+
+	def put(self, namespace, key, value, ttl=None):
+		"""Stores value; returns False if key or value cannot be pickled."""
+		return self.put_many(namespace, [(key, value)], ttl) == 1
+
+	def put_many(self, namespace, items, ttl=None):
+		"""
+		Stores items in one transaction; returns how many were stored.
+
+		Items are (key, value) pairs or (key, value, ttl) triples whose
+		own ttl (seconds left, None for no expiry) replaces the argument.
+		"""
+		now = time.time()
+		rows = []
+		for key, value, *item_ttl in items:
+			seconds = item_ttl[0] if item_ttl else ttl
+			if seconds is not None and seconds <= 0:
+				continue
+			expires = None if seconds is None else now + seconds
+			try:
+				kind, blob = _dumps_value(value)
+				rows.append((namespace, _dumps_key(key), kind, blob, len(blob), expires, now))
+			except _PICKLE_ERRORS:
+				continue
+		if not rows:
+			return 0
+
+		with self._lock:
+			if self._db is None:
+				return 0
+			self._db.execute('BEGIN IMMEDIATE')
+			try:
+				# Other processes write to the file too: the total is only exact under the write lock
+				self.currbytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+				for row in rows:
+					previous = self._db.execute(
+						'SELECT size FROM entries WHERE namespace = ? AND key = ?', row[:2]
+					).fetchone()
+					self.currbytes -= previous[0] if previous else 0
+					self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+					self.currbytes += row[4]
+				self._shrink(now, [row[:2] for row in rows])
+				self._db.execute('COMMIT')
+			except BaseException:
+				self._db.execute('ROLLBACK')
+				self.currbytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+				raise
+		return len(rows)
+
+	def recent(self, namespace, limit):
+		"""
+		Up to limit most recently used live entries, oldest first, as
+		(key, value, seconds left or None) triples.
+		"""
+		now = time.time()
+		with self._lock:
+			if self._db is None:
+				return []
+			rows = self._db.execute(
+				'SELECT key, kind, value, expires FROM entries WHERE namespace = ? AND (expires IS NULL OR expires > ?) '
+				'ORDER BY used DESC LIMIT ?',
+				(namespace, now, -1 if limit is None else limit)
+			).fetchall()
+		items = []
+		for key, kind, value, expires in reversed(rows):
+			try:
+				items.append((pickle.loads(key), _loads_value(kind, value), None if expires is None else expires - now))
+			except Exception:
+				# Written by an older version of the code (renamed class, removed module)
+				continue
+		return items
+
+	def clear(self, namespace=None):
+		with self._lock:
+			if self._db is None:
+				return
+			if namespace is None:
+				self._db.execute('DELETE FROM entries')
+			else:
+				self._db.execute('DELETE FROM entries WHERE namespace = ?', (namespace,))
+			self.currbytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+	def close(self):
+		"""Closes the file; later reads miss and writes (e.g. the exit flush) are ignored."""
+		with self._lock:
+			if self._db is not None:
+				self._db.close()
+				self._db = None
+
+	def _shrink(self, now, written):
+		"""
+		Deletes least recently used rows until currbytes fits maxbytes.
+
+		Runs inside the write transaction. written are the (namespace,
+		key) pairs of this transaction: they go only after every older
+		row, oldest first, and the last of them always stays.
+		"""
+		if self.maxbytes is None or self.currbytes <= self.maxbytes:
+			return
+		self._db.execute('DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?', (now,))
+		self.currbytes = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+		if self.currbytes <= self.maxbytes:
+			return
+
+		written_keys = set(written)
+		victims = []
+		cursor = self._db.execute('SELECT rowid, namespace, key, size FROM entries ORDER BY used')
+		while self.currbytes > self.maxbytes:
+			row = cursor.fetchone()
+			if row is None:
+				break
+			if (row[1], row[2]) not in written_keys:
+				victims.append(row[0])
+				self.currbytes -= row[3]
+		cursor.close()
+		for namespace, key in written[:-1]:
+			if self.currbytes <= self.maxbytes:
+				break
+			row = self._db.execute(
+				'SELECT rowid, size FROM entries WHERE namespace = ? AND key = ?', (namespace, key)
+			).fetchone()
+			if row is not None and row[0] not in victims:
+				victims.append(row[0])
+				self.currbytes -= row[1]
+		self._db.executemany('DELETE FROM entries WHERE rowid = ?', [(rowid,) for rowid in victims])
+
+
+def _dumps_key(key):
+	return pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _dumps_value(value):
+	if type(value) is bytes:
+		return RAW, value
+	return PICKLED, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _loads_value(kind, blob):
+	return blob if kind == RAW else pickle.loads(blob)
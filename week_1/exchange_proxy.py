@@ -1,13 +1,67 @@
 import json
+import queue
+import selectors
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import urllib.request
+from urllib.parse import urlsplit
+
+import batch_rates
+import proxy_metrics
+from rate_cache import RateCache
+from rate_payload import RatePayload
+from rate_table import RateTable
+from upstream import UpstreamError, fetch_rates
+
 
 class CurrencyProxyHandler(BaseHTTPRequestHandler):
     """Обработчик HTTP запросов для проксирования курсов валют."""
-    
+
+    # HTTP/1.1: клиент может отправлять запросы по одному соединению
+    protocol_version = 'HTTP/1.1'
+    # Сколько секунд ждать следующего запроса в keep-alive соединении
+    timeout = 5
+    # Заголовки и тело уходят отдельными write; без TCP_NODELAY второй ждёт delayed ACK клиента
+    disable_nagle_algorithm = True
+
+    # Снимок курсов опорной валюты; если None, курсы каждой базы кэшируются отдельно
+    rate_table = None
+    rate_cache = RateCache(
+        lambda currency_code: RatePayload(fetch_rates(currency_code)),
+        on_lookup=proxy_metrics.cache_lookup
+    )
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
     def do_GET(self):
+        url = urlsplit(self.path)
+        timer = proxy_metrics.RequestTimer(proxy_metrics.route_label(url.path))
+        self.status_code = 500
+        try:
+            self.route(url)
+        finally:
+            timer.finish(self.status_code)
+
+    def route(self, url):
+        if url.path.strip('/') == batch_rates.BATCH_PATH:
+            self.send_batch(url.query)
+            return
+        if url.path.strip('/') == proxy_metrics.METRICS_PATH:
+            body = proxy_metrics.REGISTRY.render()
+            self.send_response(200)
+            self.send_header('Content-Type', proxy_metrics.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
         # Извлекаем код валюты из пути
-        path = self.path.strip('/')
+        path = url.path.strip('/')
         if not path:
             self.send_error_response(400, "Currency code is required. Example: /USD")
             return
@@ -18,36 +72,68 @@ class CurrencyProxyHandler(BaseHTTPRequestHandler):
             return
         
         try:
-            # Запрос к внешнему API
-            url = f"https://api.exchangerate-api.com/v4/latest/{currency_code}"
-            req = urllib.request.Request(url, headers={'User-Agent': 'CurrencyProxy/1.0'})
-            
-            with urllib.request.urlopen(req, timeout=10) as response:
-                data = response.read()
-                
-                # Проверяем, не является ли ответ ошибкой
-                result = json.loads(data)
-                if 'error' in result and result['error'] == 'Invalid base currency':
-                    self.send_error_response(404, f"Currency not found: {currency_code}")
-                    return
-                
-                # Отправляем успешный ответ
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(data)
-                
-        except urllib.error.HTTPError as e:
-            if e.code == 404:
-                self.send_error_response(404, f"Currency not found: {currency_code}")
-            else:
-                self.send_error_response(502, f"External API error: {e.code}")
-        except urllib.error.URLError as e:
-            self.send_error_response(502, f"Cannot connect to exchange rate API: {str(e)}")
+            payload = self.get_rates(currency_code)
+
+            # Отправляем успешный ответ или 304, если у клиента актуальная версия
+            self.send_rates(payload)
+
+        except UpstreamError as e:
+            self.send_error_response(e.status_code, e.message)
         except Exception as e:
             self.send_error_response(500, f"Internal server error: {str(e)}")
     
+    def get_rates(self, currency_code):
+        """Возвращает RatePayload с курсами для currency_code."""
+        if self.rate_table is None:
+            return self.rate_cache.get(currency_code)
+
+        # Курсы считаются локально из снимка опорной валюты
+        payload = self.rate_table.rate_payload(currency_code)
+        if payload is None:
+            raise UpstreamError(404, f"Currency not found: {currency_code}")
+        return payload
+
+    def send_rates(self, payload):
+        """Отправляет курсы с учётом Accept-Encoding и условных заголовков."""
+        status_code, headers, body = payload.response(
+            self.headers.get('Accept-Encoding'),
+            self.headers.get('If-None-Match'),
+            self.headers.get('If-Modified-Since'),
+        )
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_stopping_header()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_batch(self, query):
+        """Отдаёт курсы нескольких баз потоком NDJSON в chunked-ответе."""
+        try:
+            bases, symbols = batch_rates.parse_batch_query(query)
+        except ValueError as e:
+            self.send_error_response(400, str(e))
+            return
+
+        # Длина заранее неизвестна: HTTP/1.1 получает chunked, старые клиенты - тело до закрытия соединения
+        chunked = self.request_version == 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', batch_rates.CONTENT_TYPE)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_stopping_header()
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        for line in batch_rates.stream_batch(bases, symbols, self.get_rates):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line) if chunked else line)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
     def send_error_response(self, status_code, message):
         """Отправляет JSON ответ с ошибкой."""
         error_data = {
@@ -55,22 +141,268 @@ class CurrencyProxyHandler(BaseHTTPRequestHandler):
             "status_code": status_code,
             "message": message
         }
-        
+        self.send_json(status_code, json.dumps(error_data).encode('utf-8'))
+
+    def send_json(self, status_code, body):
+        """Отправляет готовое JSON тело ответа."""
         self.send_response(status_code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_stopping_header()
         self.end_headers()
-        self.wfile.write(json.dumps(error_data).encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_stopping_header(self):
+        if getattr(self.server, 'stopping', False):
+            # При остановке сервера не держим keep-alive соединения
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP сервер, обслуживающий запросы в ограниченном пуле потоков.
+
+    Поток пула занят одним запросом, а не соединением: между запросами
+    keep-alive соединение ждёт в selector, поэтому активные клиенты не
+    вытесняют остальных. Одновременно выполняется не больше
+    max_in_flight запросов, готовые сверх лимита ждут свободного потока.
+    Соединения, простаивающие дольше timeout обработчика, закрываются.
+    shutdown() дожидается уже начатых запросов.
+    """
 
+    def __init__(self, server_address, handler_class, workers=32, max_in_flight=None):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.max_in_flight = max_in_flight or workers
+        self.stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='proxy-worker')
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        # Соединения ждут следующего запроса в selector потока _poll; другие
+        # потоки передают их через очередь и будят его байтом в socketpair
+        self._selector = selectors.DefaultSelector()
+        self._parked = queue.SimpleQueue()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._closed = False
+        self._poller = threading.Thread(target=self._poll, name='proxy-poller', daemon=True)
+        self._poller.start()
+
+    def process_request(self, request, client_address):
+        # Обработчик живёт всё время соединения: в его rfile могут остаться
+        # уже прочитанные байты следующего запроса
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.request = request
+        handler.client_address = client_address
+        handler.server = self
+        handler.setup()
+        handler.close_connection = True
+        self._park(handler)
+
+    def _park(self, handler):
+        handler.parked_at = time.monotonic()
+        self._parked.put(handler)
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            # Буфер полон: поток _poll и так проснётся
+            pass
+
+    def _poll(self):
+        idle_timeout = self.RequestHandlerClass.timeout
+        swept_at = time.monotonic()
+        while not self._closed:
+            for key, _ in self._selector.select(timeout=1.0):
+                if key.fileobj is self._wakeup_recv:
+                    self._register_parked()
+                    continue
+                self._selector.unregister(key.fileobj)
+                self._in_flight.acquire()
+                self._executor.submit(self._process_request, key.data)
+
+            now = time.monotonic()
+            if idle_timeout is not None and now - swept_at >= 1.0:
+                swept_at = now
+                for key in list(self._selector.get_map().values()):
+                    if key.data is not None and now - key.data.parked_at > idle_timeout:
+                        self._selector.unregister(key.fileobj)
+                        self._close(key.data)
+
+    def _register_parked(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                handler = self._parked.get_nowait()
+            except queue.Empty:
+                return
+            self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+
+    def _process_request(self, handler):
+        keep_alive = False
+        try:
+            # Запросы, уже лежащие в буфере (pipelining), обслуживаются сразу
+            while True:
+                handler.handle_one_request()
+                keep_alive = not handler.close_connection
+                if not keep_alive or not self._has_buffered(handler):
+                    break
+        except Exception:
+            keep_alive = False
+            self.handle_error(handler.request, handler.client_address)
+        finally:
+            self._in_flight.release()
+        if keep_alive:
+            self._park(handler)
+        else:
+            self._close(handler)
+
+    def _has_buffered(self, handler):
+        """Есть ли уже полученные байты следующего запроса, без ожидания."""
+        handler.connection.setblocking(False)
+        try:
+            return bool(handler.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            handler.connection.settimeout(handler.timeout)
+
+    def _close(self, handler):
+        try:
+            handler.finish()
+        except OSError:
+            pass
+        self.shutdown_request(handler.request)
+
+    def shutdown(self):
+        self.stopping = True
+        super().shutdown()
+
+    def server_close(self):
+        super().server_close()
+        self._closed = True
+        self._wake()
+        self._poller.join()
+        self._executor.shutdown(wait=True)
+        # Простаивающие keep-alive соединения закрываем без ответа
+        self._register_parked()
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                self._close(key.data)
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+
+def run_server(port=8000, snapshot=False, reference='USD', refresh_interval=60.0,
+               workers=32, max_in_flight=None, cache_ttl=60.0):
+    """
+    Запускает HTTP сервер.
+
+    Запросы обслуживаются пулом из workers потоков, так что медленный
+    ответ внешнего API не блокирует остальных клиентов. По SIGINT/SIGTERM
+    сервер перестаёт принимать соединения и дожидается уже принятых.
+
+    Курсы каждой базы кэшируются на cache_ttl секунд вместе с готовыми
+    сжатыми вариантами ответа. С snapshot=True курсы опорной валюты
+    загружаются раз в refresh_interval секунд, а остальные базы
+    считаются из них локально.
+    """
+    CurrencyProxyHandler.rate_cache.ttl = cache_ttl
+    if snapshot:
+        CurrencyProxyHandler.rate_table = RateTable(
+            fetch_rates, reference=reference, refresh_interval=refresh_interval
+        )
 
-def run_server(port=8000):
-    """Запускает HTTP сервер."""
     server_address = ('', port)
-    httpd = HTTPServer(server_address, CurrencyProxyHandler)
-    print(f"Starting server on port {port}")
+    httpd = PooledHTTPServer(server_address, CurrencyProxyHandler, workers=workers, max_in_flight=max_in_flight)
+
+    def stop(signum, frame):
+        # shutdown() ждёт выхода из serve_forever, поэтому вызываем его из другого потока
+        threading.Thread(target=httpd.shutdown).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Starting server on port {port} with {workers} workers")
     print(f"Test with: http://localhost:{port}/USD")
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        print("Server stopped")
+
+
+def _self_check():
+    """Проверки PooledHTTPServer на локальном сокете, без внешнего API."""
+    import http.client
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        timeout = 5
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/slow':
+                time.sleep(1.0)
+            body = self.path.encode('ascii')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def get(conn, path):
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.read()
+
+    # Один поток пула: keep-alive соединения между запросами его не держат
+    server = PooledHTTPServer(('127.0.0.1', 0), Handler, workers=1)
+    serving = threading.Thread(target=server.serve_forever, daemon=True)
+    serving.start()
+    port = server.server_port
+    first = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    second = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    assert get(first, '/a') == b'/a'
+    sock = first.sock
+    assert get(second, '/b') == b'/b'
+    # Второй запрос по тому же сокету: соединение дождалось его в selector.
+    # Без пробуждения поток _poll увидел бы его только через секунду select
+    started = time.monotonic()
+    assert get(first, '/c') == b'/c' and first.sock is sock
+    assert time.monotonic() - started < 0.5
+
+    # Остановка дожидается начатого запроса и закрывает простаивающие соединения
+    slow = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    slow.request('GET', '/slow')
+    time.sleep(0.1)
+    server.shutdown()
+    server.server_close()
+    serving.join()
+    # Ответ уже отправлен к возврату из server_close
+    slow.sock.settimeout(0.05)
+    assert slow.getresponse().read() == b'/slow'
+    assert second.sock.recv(1) == b''
+    for conn in (first, second, slow):
+        conn.close()
+    print('ok')
 
 
 if __name__ == "__main__":
-    run_server()
\ No newline at end of file
+    import sys
+
+    if sys.argv[1:] == ['--self-check']:
+        _self_check()
+    else:
+        run_server()
\ No newline at end of file
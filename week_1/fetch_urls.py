@@ -1,42 +1,162 @@
+import argparse
 import asyncio
+import json
+import os
+from itertools import islice
+
 import aiohttp
 import aiofiles
-import json
 
-urls = [
-    "https://example.com",
-    "https://httpbin.org/status/404",
-    "https://nonexistent.url"
-]
-
-async def make_request(session: aiohttp.ClientSession, url: str, sem: asincio.Semaphore):
-    async with sem:
-        try:
-            async with session.get(url) as resp:
-                return url, resp.status
-        except aiohttp.client_exceptions.ClientConnectorDNSError:
-            return url, 0
-
-
-async def fetch_urls(urls: list[str], file_path: str):
-    async with aiofiles.open(file_path, 'w') as file:
-        await file.write('')
-    limit = asyncio.Semaphore(5)
-    async with aiohttp.ClientSession() as session:
-        tasks = [make_request(session, url, limit) for url in urls]
-        results = await asyncio.gather(*tasks)
-
-    data = [
-        {
-            'url': url,
-            'status_code': status_code
-        }
-        for url, status_code in results
-    ]
-    for item in data:
+WORKERS = 100
+FLUSH_EVERY = 1000
+# Seconds a finished result may wait in the buffer when results come slowly
+FLUSH_INTERVAL = 1.0
+
+
+def read_urls(path):
+    """URLs from a text file, one per line, read lazily."""
+    with open(path) as file:
+        for line in file:
+            url = line.strip()
+            if url:
+                yield url
+
+
+async def make_request(session: aiohttp.ClientSession, url: str):
+    try:
+        async with session.get(url) as resp:
+            return url, resp.status
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        # DNS failures, refused connections and timeouts are reported as status 0
+        return url, 0
+
+
+def load_checkpoint(file_path: str, checkpoint_path: str):
+    """
+    Indexes already fetched by an interrupted run.
+
+    The checkpoint holds the index below which every URL is done; the
+    results file is scanned for indexes at or above it. A line cut off
+    by a crash is truncated so new results start on a fresh line.
+    Returns (low_water, set of done indexes >= low_water).
+    """
+    low_water = 0
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as file:
+            low_water = json.load(file)['low_water']
+
+    done = set()
+    if not os.path.exists(file_path):
+        return low_water, done
+    with open(file_path, 'rb+') as file:
+        valid_end = 0
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            valid_end += len(line)
+            index = json.loads(line).get('index')
+            # Lines of the previous format have no index: their URLs are fetched again
+            if index is not None and index >= low_water:
+                done.add(index)
+        file.truncate(valid_end)
+    return low_water, done
+
+
+def save_checkpoint(checkpoint_path: str, low_water: int):
+    # Write then rename: a crash leaves either the old or the new checkpoint
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'low_water': low_water}, file)
+    os.replace(tmp_path, checkpoint_path)
+
+
+async def fetch_urls(urls, file_path: str, workers: int = WORKERS, checkpoint_path: str = None,
+                     resume: bool = False, flush_every: int = FLUSH_EVERY,
+                     flush_interval: float = FLUSH_INTERVAL):
+    """
+    Fetches any number of URLs with a fixed pool of worker coroutines.
+
+    urls can be a lazy iterable (see read_urls): it is read only as fast
+    as the workers take URLs from a bounded queue, so memory does not
+    grow with the number of URLs. Results are appended to file_path as
+    JSON lines in completion order by a single writer, flushed every
+    flush_every results, at least every flush_interval seconds while
+    results arrive, and at the end. After each flush the checkpoint is updated;
+    with resume=True an interrupted run continues where it stopped
+    without fetching finished URLs again.
+    """
+    checkpoint_path = checkpoint_path or file_path + '.checkpoint'
+    if resume:
+        low_water, done = load_checkpoint(file_path, checkpoint_path)
+    else:
+        low_water, done = 0, set()
+        async with aiofiles.open(file_path, 'w') as file:
+            await file.write('')
+        save_checkpoint(checkpoint_path, 0)
+
+    url_queue = asyncio.Queue(maxsize=2 * workers)
+    result_queue = asyncio.Queue(maxsize=2 * workers)
+
+    async def produce():
+        for index, url in enumerate(islice(urls, low_water, None), start=low_water):
+            if index not in done:
+                await url_queue.put((index, url))
+        for _ in range(workers):
+            await url_queue.put(None)
+
+    async def work(session):
+        while (item := await url_queue.get()) is not None:
+            index, url = item
+            url, status_code = await make_request(session, url)
+            await result_queue.put({'index': index, 'url': url, 'status_code': status_code})
+        await result_queue.put(None)
+
+    async def write():
+        nonlocal low_water
+        loop = asyncio.get_running_loop()
+        finished_workers = 0
+        lines = []
         async with aiofiles.open(file_path, 'a') as file:
-            await file.write(json.dumps(item) + '\n')
+            flushed_at = loop.time()
+            while finished_workers < workers:
+                try:
+                    item = await asyncio.wait_for(
+                        result_queue.get(), max(0.0, flushed_at + flush_interval - loop.time())
+                    )
+                except asyncio.TimeoutError:
+                    # No result within the interval: flush what is buffered
+                    item = ()
+                if item is None:
+                    finished_workers += 1
+                elif item:
+                    lines.append(json.dumps(item) + '\n')
+                    done.add(item['index'])
+                if (len(lines) < flush_every and finished_workers < workers
+                        and loop.time() - flushed_at < flush_interval):
+                    continue
+                flushed_at = loop.time()
+                if lines:
+                    await file.write(''.join(lines))
+                    await file.flush()
+                    lines.clear()
+                    # Everything below low_water is on disk; only the window above it stays in memory
+                    while low_water in done:
+                        done.discard(low_water)
+                        low_water += 1
+                    save_checkpoint(checkpoint_path, low_water)
+
+    connector = aiohttp.TCPConnector(limit=workers, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(produce(), write(), *(work(session) for _ in range(workers)))
 
 
 if __name__ == '__main__':
-    asyncio.run(fetch_urls(urls, './results.jsonl'))
+    parser = argparse.ArgumentParser(description='Fetch status codes of URLs into a JSON lines file.')
+    parser.add_argument('urls_file', nargs='?', default='./urls.txt', help='one URL per line')
+    parser.add_argument('--output', default='./results.jsonl')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run')
+    args = parser.parse_args()
+
+    asyncio.run(fetch_urls(read_urls(args.urls_file), args.output, workers=args.workers, resume=args.resume))
@@ -1,34 +1,173 @@
 import asyncio
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
 import aiohttp
 import aiofiles
 import json
 
-urls = [line for line in open('urls.txt')]
+urls = [line.strip() for line in open('urls.txt') if line.strip()]
+
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 32
+RATE = 20.0            # requests per second per host
+BURST = 10
+RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+LATENCY_FACTOR = 2.0   # slower than this times the host's best latency counts as congestion
+
+
+class HostLimiter:
+    """
+    Concurrency and rate limits of one host.
+
+    The number of requests in flight adapts AIMD-style: every fast
+    successful response adds about 1/limit, so the limit grows by one
+    per round trip; a 429, a 5xx, a connection error or a latency over
+    LATENCY_FACTOR times the best seen halves it, at most once per round
+    trip. Independently, a token bucket caps the request rate at rate
+    per second with bursts of up to burst requests.
+    """
+
+    def __init__(self, concurrency=INITIAL_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                 rate=RATE, burst=BURST):
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.best_latency = None
+        self.latency = None
+        self.decreased_at = 0.0
+        self._slots = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        await self._take_token()
+
+    async def release(self, latency, ok):
+        """Frees the slot; ok=None says nothing about congestion and leaves the limit as it is."""
+        if ok is not None:
+            self._adjust(latency, ok)
+        async with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+    def _adjust(self, latency, ok):
+        now = time.monotonic()
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            # Creeps up slowly so a host that got slower for good gets a new baseline
+            self.best_latency = latency if self.best_latency is None else min(latency, self.best_latency * 1.01)
+        congested = not ok or (latency is not None and latency > LATENCY_FACTOR * self.best_latency)
+
+        if not congested:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        elif now - self.decreased_at > (self.latency or 0):
+            # Responses to requests sent before the last decrease do not count again
+            self.limit = max(1.0, self.limit / 2)
+            self.decreased_at = now
 
-async def process_url(session: aiohttp.ClientSession, url: str, sem: asincio.Semaphore, file_path: str):
-    async with sem:
+    def pause(self, seconds):
+        """No new requests to the host for seconds (Retry-After)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def retry_after(headers):
+    """Seconds from a Retry-After header; the HTTP-date form is ignored."""
+    try:
+        return max(0.0, float(headers.get('Retry-After', '')))
+    except ValueError:
+        return None
+
+
+def backoff(attempt, delay=None):
+    """Full jitter: a random wait up to the exponential step, so retries do not come in waves."""
+    step = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(0, step) + (delay or 0)
+
+
+async def get_json(session: aiohttp.ClientSession, url: str, host: HostLimiter, retries: int = RETRIES):
+    """JSON body of url, or {} when it is unavailable after retries."""
+    for attempt in range(retries + 1):
+        await host.acquire()
+        started = time.monotonic()
+        latency, ok, delay = None, False, None
         try:
-            await asyncio.sleep(2)
             async with session.get(url) as resp:
-                content = await resp.json()
+                if resp.status == 429 or resp.status >= 500:
+                    delay = retry_after(resp.headers)
+                    if resp.status == 429 and delay is not None:
+                        host.pause(delay)
+                else:
+                    ok = True
+                    content = await resp.json(content_type=None) if resp.status < 400 else {}
+                latency = time.monotonic() - started
         except aiohttp.client_exceptions.ClientConnectorDNSError:
-            content = {}
+            # Host does not exist; retrying will not help, and it says nothing about load
+            await host.release(None, None)
+            return {}
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        except ValueError:
+            # Not JSON
+            ok, content = True, {}
+        await host.release(latency, ok)
+
+        if ok:
+            return content
+        if attempt < retries:
+            await asyncio.sleep(backoff(attempt, delay))
+    return {}
+
 
-        data = {
-            'url': url,
-            'content': content
-        }
-        async with aiofiles.open(file_path, 'a') as file:
-            await file.write(json.dumps(data) + '\n')
+async def process_url(session: aiohttp.ClientSession, url: str, host: HostLimiter, file):
+    content = await get_json(session, url, host)
+    data = {
+        'url': url,
+        'content': content
+    }
+    await file.write(json.dumps(data) + '\n')
 
 
-async def fetch_urls(urls: list[str], file_path: str):
+async def fetch_urls(urls: list[str], file_path: str, **limits):
+    """
+    Fetches urls with per-host limits; limits are HostLimiter arguments
+    (concurrency, max_concurrency, rate, burst) shared by every host.
+    """
+    hosts = defaultdict(lambda: HostLimiter(**limits))
+    max_concurrency = limits.get('max_concurrency', MAX_CONCURRENCY)
+    # Keep-alive sockets per host up to the AIMD ceiling, DNS answers cached for 5 minutes
+    connector = aiohttp.TCPConnector(
+        limit=0, limit_per_host=max_concurrency, ttl_dns_cache=300, keepalive_timeout=30
+    )
+    timeout = aiohttp.ClientTimeout(total=30, connect=10)
     async with aiofiles.open(file_path, 'w') as file:
-        await file.write('')
-    limit = asyncio.Semaphore(5)
-    async with aiohttp.ClientSession() as session:
-        tasks = (process_url(session, url, limit, file_path) for url in urls)
-        await asyncio.gather(*tasks)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = (process_url(session, url, hosts[urlsplit(url).netloc], file) for url in urls)
+            await asyncio.gather(*tasks)
 
 
 if __name__ == '__main__':
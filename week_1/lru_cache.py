@@ -1,7 +1,19 @@
+import asyncio
+import atexit
+import inspect
+import random
+import os
+import sys
+import tempfile
+import threading
+import time
 import unittest.mock
-from collections import OrderedDict
+import weakref
+from collections import OrderedDict, namedtuple
 from functools import wraps
 
+from disk_cache import DiskStore
+
 
 def lru_cache_v1(*args, **kwargs):
 	maxsize = kwargs.get('maxsize', None)
@@ -76,9 +88,985 @@ def lru_cache_v2(*args, **kwargs):
 		return deco
 
 
+class _KwdMark:
+	"""Separator of args and kwargs in keys; unpickles as the same object."""
+	__slots__ = ()
+
+	def __reduce__(self):
+		# Pickled by name, so keys read back from a DiskStore still match
+		return '_KWD_MARK'
+
+	def __repr__(self):
+		return '_KWD_MARK'
+
+
+_MISSING = object()
+_KWD_MARK = _KwdMark()
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+# A lone argument of these types is its own key: none of them can equal a tuple key
+_FAST_TYPES = frozenset({int, str, bytes, float, type(None)})
+
+
+def _make_key(args, kwargs, typed):
+	"""
+	Flat hashable key for a call.
+
+	Positional-only calls use the args tuple itself and a single
+	argument of a _FAST_TYPES type is used directly, so neither builds
+	a new object. Keyword calls are laid out as one flat tuple
+	(*args, _KWD_MARK, *names, *values): the marker position gives the
+	number of positional arguments and the rest splits in half.
+	"""
+	if kwargs:
+		key = (*args, _KWD_MARK, *kwargs, *kwargs.values())
+		if typed:
+			key += tuple(map(type, args)) + tuple(map(type, kwargs.values()))
+		return key
+	if typed:
+		return args + tuple(map(type, args))
+	if len(args) == 1 and type(args[0]) in _FAST_TYPES:
+		return args[0]
+	return args
+
+
+def deep_sizeof(obj, _seen=None):
+	"""
+	Approximate memory held by obj in bytes, following containers.
+
+	Objects reachable twice (shared strings, interned ints) are counted
+	once. Custom objects are measured through their __dict__/__slots__.
+	"""
+	if _seen is None:
+		_seen = set()
+	if id(obj) in _seen:
+		return 0
+	_seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, (str, bytes, bytearray, memoryview, int, float, bool, type(None))):
+		return size
+	if isinstance(obj, dict):
+		for key, value in obj.items():
+			size += deep_sizeof(key, _seen) + deep_sizeof(value, _seen)
+	elif isinstance(obj, (list, tuple, set, frozenset)):
+		for item in obj:
+			size += deep_sizeof(item, _seen)
+	else:
+		if hasattr(obj, '__dict__'):
+			size += deep_sizeof(vars(obj), _seen)
+		for name in getattr(type(obj), '__slots__', ()):
+			if hasattr(obj, name):
+				size += deep_sizeof(getattr(obj, name), _seen)
+	return size
+
+
+class _Link:
+	__slots__ = ('prev', 'next', 'key', 'value', 'size', 'expires')
+
+	def __init__(self, key=None, value=None, size=0, expires=None):
+		self.prev = self.next = self
+		self.key = key
+		self.value = value
+		self.size = size
+		self.expires = expires
+
+
+# Bookkeeping per entry on top of the value: the link itself and its dict slot
+_ENTRY_OVERHEAD = sys.getsizeof(_Link()) + 3 * sys.getsizeof(0)
+
+
+class LRUCache:
+	"""
+	Thread-safe LRU mapping with O(1) get/put.
+
+	Entries live in a dict of key -> _Link plus a circular doubly linked
+	list ordered from least (root.next) to most (root.prev) recently used.
+	A hit only reorders the list if the lock is free right now; under
+	contention the reorder is skipped, which keeps hits from queueing on
+	the lock at the cost of slightly approximate recency.
+
+	Limits, all optional:
+	- maxsize: number of entries;
+	- maxbytes: total sizeof(value) plus a fixed per-entry overhead.
+	  sizeof defaults to deep_sizeof; pass len for bytes/str payloads
+	  or any cheaper estimate. A value larger than maxbytes is not stored;
+	- ttl: seconds an entry stays valid after put. Expired entries are
+	  dropped lazily on get, and by expire() / the sweeper thread so
+	  that entries nobody asks for again do not hold memory.
+
+	on_evict(key, value, reason) is called outside the lock for every
+	entry dropped by a limit; reason is 'size', 'bytes' or 'expired'.
+	If on_evict has a true takes_ttl attribute, it also gets the seconds
+	the entry had left (None without ttl), so it can keep the expiry.
+	"""
+
+	def __init__(self, maxsize=128, maxbytes=None, sizeof=None, ttl=None, on_evict=None, clock=time.monotonic):
+		self.maxsize = maxsize
+		self.maxbytes = maxbytes
+		self.sizeof = sizeof or deep_sizeof
+		self.ttl = ttl
+		self.on_evict = on_evict
+		self.clock = clock
+		self.hits = 0
+		self.misses = 0
+		self.currbytes = 0
+		self._map = {}
+		self._root = _Link()
+		self._lock = threading.Lock()
+		self._sweeper = None
+		self._stopped = threading.Event()
+
+	def __len__(self):
+		return len(self._map)
+
+	def get(self, key, default=_MISSING):
+		link = self._map.get(key)
+		if link is None:
+			self.misses += 1
+			return default
+		if link.expires is not None and link.expires <= self.clock():
+			self._expire_link(link)
+			self.misses += 1
+			return default
+		lock = self._lock
+		if lock.acquire(False):
+			# Inlined _move_to_end: this is the hot path
+			if link.next is not None:
+				root = self._root
+				link.prev.next = link.next
+				link.next.prev = link.prev
+				link.prev = last = root.prev
+				link.next = root
+				last.next = root.prev = link
+			lock.release()
+		self.hits += 1
+		return link.value
+
+	def put(self, key, value, ttl=None):
+		"""Stores value for ttl seconds, or the cache's ttl when None."""
+		maxsize, maxbytes = self.maxsize, self.maxbytes
+		if maxsize == 0:
+			return
+		size = 0
+		if maxbytes is not None:
+			size = self.sizeof(value) + _ENTRY_OVERHEAD
+			if size > maxbytes:
+				# Not stored, but the previous value for key must not be served either
+				self.discard(key)
+				return
+		ttl = self.ttl if ttl is None else ttl
+		expires = None if ttl is None else self.clock() + ttl
+
+		evicted = None
+		with self._lock:
+			cache_map = self._map
+			root = self._root
+			link = cache_map.get(key)
+			if link is not None:
+				self.currbytes += size - link.size
+				link.value, link.size, link.expires = value, size, expires
+				self._move_to_end(link)
+			else:
+				last = root.prev
+				link = _Link(key, value, size, expires)
+				link.prev, link.next = last, root
+				last.next = root.prev = link
+				cache_map[key] = link
+				self.currbytes += size
+				# One insert can only push the count one entry over
+				if maxsize is not None and len(cache_map) > maxsize:
+					evicted = [(self._unlink(root.next), 'size')]
+			if maxbytes is not None and self.currbytes > maxbytes:
+				evicted = evicted or []
+				while self.currbytes > maxbytes:
+					evicted.append((self._unlink(root.next), 'bytes'))
+		if evicted is not None and self.on_evict is not None:
+			self._notify(evicted)
+
+	def discard(self, key):
+		"""Removes key if present, without calling on_evict."""
+		with self._lock:
+			link = self._map.get(key)
+			if link is not None:
+				self._unlink(link)
+
+	def expire(self):
+		"""Drops every expired entry; returns how many were dropped."""
+		if self.ttl is None:
+			return 0
+		now = self.clock()
+		evicted = []
+		with self._lock:
+			root = self._root
+			link = root.next
+			while link is not root:
+				following = link.next
+				if link.expires <= now:
+					evicted.append((self._unlink(link), 'expired'))
+				link = following
+		self._notify(evicted)
+		return len(evicted)
+
+	def start_sweeper(self, interval):
+		"""Runs expire() every interval seconds in a daemon thread."""
+		with self._lock:
+			if self._sweeper is None:
+				self._stopped.clear()
+				self._sweeper = threading.Thread(
+					target=_sweep, args=(weakref.ref(self), interval, self._stopped), daemon=True
+				)
+				self._sweeper.start()
+
+	def stop_sweeper(self):
+		self._stopped.set()
+		self._sweeper = None
+
+	def clear(self):
+		with self._lock:
+			# Like _unlink: a lock-free hit still holding a link must not relink it
+			for link in self._map.values():
+				link.prev = link.next = None
+			self._map.clear()
+			self._root.prev = self._root.next = self._root
+			self.hits = self.misses = self.currbytes = 0
+
+	def info(self):
+		return CacheInfo(self.hits, self.misses, self.maxsize, len(self._map))
+
+	def items(self, remaining=False):
+		"""
+		Live (key, value) pairs from least to most recently used; with
+		remaining=True, (key, value, seconds left or None) triples.
+		"""
+		now = self.clock()
+		with self._lock:
+			root = self._root
+			link = root.next
+			items = []
+			while link is not root:
+				if link.expires is None:
+					items.append((link.key, link.value, None) if remaining else (link.key, link.value))
+				elif link.expires > now:
+					items.append((link.key, link.value, link.expires - now) if remaining else (link.key, link.value))
+				link = link.next
+		return items
+
+	def _expire_link(self, link):
+		with self._lock:
+			# Another thread may have already dropped or replaced it
+			if link.next is None or self._map.get(link.key) is not link:
+				return
+			self._unlink(link)
+		self._notify([(link, 'expired')])
+
+	def _notify(self, evicted):
+		on_evict = self.on_evict
+		if on_evict is None:
+			return
+		if getattr(on_evict, 'takes_ttl', False):
+			now = self.clock()
+			for link, reason in evicted:
+				on_evict(link.key, link.value, reason, None if link.expires is None else link.expires - now)
+		else:
+			for link, reason in evicted:
+				on_evict(link.key, link.value, reason)
+
+	def _move_to_end(self, link):
+		root = self._root
+		link.prev.next = link.next
+		link.next.prev = link.prev
+		link.prev, link.next = root.prev, root
+		root.prev.next = root.prev = link
+
+	def _unlink(self, link):
+		link.prev.next = link.next
+		link.next.prev = link.prev
+		# A concurrent lock-free hit may still hold this link; next=None marks it evicted
+		link.prev = link.next = None
+		del self._map[link.key]
+		self.currbytes -= link.size
+		return link
+
+
+def _sweep(cache_ref, interval, stopped):
+	# Holds only a weak reference so an unused cache can still be collected
+	while not stopped.wait(interval):
+		cache = cache_ref()
+		if cache is None:
+			return
+		cache.expire()
+		del cache
+
+
+class _PolicyCache:
+	"""
+	Common part of the non-LRU policies: counters, lock and on_evict.
+
+	Subclasses implement _lookup(key) -> value or _MISSING, _insert(key,
+	value) -> list of evicted (key, value), _items() and _reset(); all
+	of them run under the lock.
+	"""
+
+	def __init__(self, maxsize=128, on_evict=None):
+		if maxsize is None or maxsize < 0:
+			raise ValueError(f"{type(self).__name__} needs a non-negative maxsize, got {maxsize!r}")
+		self.maxsize = maxsize
+		self.on_evict = on_evict
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		self._reset()
+
+	def get(self, key, default=_MISSING):
+		with self._lock:
+			value = self._lookup(key)
+		if value is _MISSING:
+			self.misses += 1
+			return default
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		if self.maxsize == 0:
+			return
+		with self._lock:
+			evicted = self._insert(key, value)
+		if self.on_evict is not None:
+			for evicted_key, evicted_value in evicted:
+				self.on_evict(evicted_key, evicted_value, 'size')
+
+	def clear(self):
+		with self._lock:
+			self._reset()
+			self.hits = self.misses = 0
+
+	def info(self):
+		return CacheInfo(self.hits, self.misses, self.maxsize, len(self))
+
+	def items(self, remaining=False):
+		"""
+		(key, value) pairs, roughly from first to last to be evicted;
+		with remaining=True, (key, value, None) triples as in LRUCache.
+		"""
+		with self._lock:
+			items = self._items()
+		return [(key, value, None) for key, value in items] if remaining else items
+
+
+class LFUCache(_PolicyCache):
+	"""
+	Least frequently used eviction in O(1).
+
+	Keys are grouped into insertion-ordered buckets by hit count; the
+	victim is the oldest key of the lowest non-empty bucket, so ties are
+	broken by LRU.
+	"""
+
+	def __len__(self):
+		return len(self._entries)
+
+	def _reset(self):
+		self._entries = {}  # key -> [value, frequency]
+		self._buckets = {}  # frequency -> {key: None}, oldest first
+		self._min_frequency = 0
+
+	def _items(self):
+		return [
+			(key, self._entries[key][0])
+			for frequency in sorted(self._buckets) for key in self._buckets[frequency]
+		]
+
+	def _lookup(self, key):
+		entry = self._entries.get(key)
+		if entry is None:
+			return _MISSING
+		self._touch(key, entry)
+		return entry[0]
+
+	def _insert(self, key, value):
+		entry = self._entries.get(key)
+		if entry is not None:
+			entry[0] = value
+			self._touch(key, entry)
+			return []
+		evicted = []
+		if len(self._entries) >= self.maxsize:
+			bucket = self._buckets[self._min_frequency]
+			victim = next(iter(bucket))
+			del bucket[victim]
+			if not bucket:
+				del self._buckets[self._min_frequency]
+			evicted.append((victim, self._entries.pop(victim)[0]))
+		self._entries[key] = [value, 1]
+		self._buckets.setdefault(1, {})[key] = None
+		self._min_frequency = 1
+		return evicted
+
+	def _touch(self, key, entry):
+		frequency = entry[1]
+		bucket = self._buckets[frequency]
+		del bucket[key]
+		if not bucket:
+			del self._buckets[frequency]
+			if self._min_frequency == frequency:
+				self._min_frequency = frequency + 1
+		entry[1] = frequency + 1
+		self._buckets.setdefault(frequency + 1, {})[key] = None
+
+
+class ARCCache(_PolicyCache):
+	"""
+	Adaptive Replacement Cache (Megiddo & Modha, FAST 2003).
+
+	t1 holds keys seen once recently, t2 keys seen at least twice; b1/b2
+	remember keys recently evicted from them (keys only). A hit in b1
+	means t1 was too small, a hit in b2 that t2 was, and the target size
+	p of t1 moves accordingly. A one-off scan only ever fills t1, so the
+	frequently used keys in t2 survive it.
+	"""
+
+	def __len__(self):
+		return len(self._t1) + len(self._t2)
+
+	def _reset(self):
+		self._t1 = OrderedDict()
+		self._t2 = OrderedDict()
+		self._b1 = OrderedDict()
+		self._b2 = OrderedDict()
+		self._p = 0
+
+	def _items(self):
+		return list(self._t1.items()) + list(self._t2.items())
+
+	def _lookup(self, key):
+		if key in self._t1:
+			value = self._t2[key] = self._t1.pop(key)
+			return value
+		if key in self._t2:
+			self._t2.move_to_end(key)
+			return self._t2[key]
+		return _MISSING
+
+	def _insert(self, key, value):
+		t1, t2, b1, b2 = self._t1, self._t2, self._b1, self._b2
+		capacity = self.maxsize
+		if key in t1 or key in t2:
+			(t1 if key in t1 else t2)[key] = value
+			return []
+
+		evicted = []
+		# REPLACE(x, p) runs while the key is still in its ghost list: the
+		# tie-break len(t1) == p only evicts from t1 for a b2 hit
+		if key in b1:
+			self._p = min(capacity, self._p + max(len(b2) // len(b1), 1))
+			self._replace(key, evicted)
+			del b1[key]
+			t2[key] = value
+			return evicted
+		if key in b2:
+			self._p = max(0, self._p - max(len(b1) // len(b2), 1))
+			self._replace(key, evicted)
+			del b2[key]
+			t2[key] = value
+			return evicted
+
+		if len(t1) + len(b1) >= capacity:
+			if len(t1) < capacity:
+				b1.popitem(last=False)
+				self._replace(key, evicted)
+			else:
+				evicted.append(t1.popitem(last=False))
+		elif len(t1) + len(t2) + len(b1) + len(b2) >= capacity:
+			if len(t1) + len(t2) + len(b1) + len(b2) >= 2 * capacity:
+				b2.popitem(last=False)
+			self._replace(key, evicted)
+		t1[key] = value
+		return evicted
+
+	def _replace(self, key, evicted):
+		t1, t2 = self._t1, self._t2
+		if len(t1) + len(t2) < self.maxsize:
+			return
+		if t1 and (len(t1) > self._p or (key in self._b2 and len(t1) == self._p)):
+			victim, value = t1.popitem(last=False)
+			self._b1[victim] = None
+		else:
+			victim, value = t2.popitem(last=False)
+			self._b2[victim] = None
+		evicted.append((victim, value))
+
+
+class _FrequencySketch:
+	"""
+	Count-Min sketch of access frequencies with periodic aging.
+
+	Four rows of small saturating counters (max 15). After sample_size
+	increments every counter is halved, so old popularity fades out.
+	"""
+	_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+	_MASK64 = (1 << 64) - 1
+	_HALVE = bytes(value >> 1 for value in range(256))
+
+	def __init__(self, capacity):
+		bits = max(4, (4 * capacity - 1).bit_length())
+		self._shift = 64 - bits
+		self.sample_size = 10 * max(capacity, 1)
+		self._rows = [bytearray(1 << bits) for _ in self._SEEDS]
+		self._additions = 0
+
+	def _indexes(self, key):
+		# Unrolled for the four rows: this runs on every cache access
+		h = hash(key) & self._MASK64
+		mask, shift = self._MASK64, self._shift
+		s0, s1, s2, s3 = self._SEEDS
+		return ((h * s0) & mask) >> shift, ((h * s1) & mask) >> shift, ((h * s2) & mask) >> shift, ((h * s3) & mask) >> shift
+
+	def increment(self, key):
+		i0, i1, i2, i3 = self._indexes(key)
+		r0, r1, r2, r3 = self._rows
+		if r0[i0] < 15:
+			r0[i0] += 1
+		if r1[i1] < 15:
+			r1[i1] += 1
+		if r2[i2] < 15:
+			r2[i2] += 1
+		if r3[i3] < 15:
+			r3[i3] += 1
+		self._additions += 1
+		if self._additions >= self.sample_size:
+			self._rows = [row.translate(self._HALVE) for row in self._rows]
+			self._additions //= 2
+
+	def frequency(self, key):
+		i0, i1, i2, i3 = self._indexes(key)
+		r0, r1, r2, r3 = self._rows
+		return min(r0[i0], r1[i1], r2[i2], r3[i3])
+
+
+class TinyLFUCache(_PolicyCache):
+	"""
+	W-TinyLFU (Einziger, Friedman & Manes, 2017), as used by Caffeine.
+
+	New keys enter a small LRU window (1% of maxsize). A key pushed out
+	of the window competes with the LRU victim of the main segmented LRU
+	(probation + protected, 80% protected) and is admitted only if the
+	frequency sketch has seen it more often. Scans pass through the
+	window without displacing the established hot set.
+	"""
+
+	def __len__(self):
+		return len(self._window) + len(self._probation) + len(self._protected)
+
+	def _reset(self):
+		self._window_size = max(1, self.maxsize // 100)
+		main_size = self.maxsize - self._window_size
+		self._protected_size = main_size * 4 // 5
+		self._main_size = main_size
+		self._window = OrderedDict()
+		self._probation = OrderedDict()
+		self._protected = OrderedDict()
+		self._sketch = _FrequencySketch(self.maxsize)
+
+	def _items(self):
+		return list(self._probation.items()) + list(self._window.items()) + list(self._protected.items())
+
+	def _lookup(self, key):
+		self._sketch.increment(key)
+		if key in self._window:
+			self._window.move_to_end(key)
+			return self._window[key]
+		if key in self._protected:
+			self._protected.move_to_end(key)
+			return self._protected[key]
+		if key in self._probation:
+			value = self._protected[key] = self._probation.pop(key)
+			if len(self._protected) > self._protected_size:
+				demoted, demoted_value = self._protected.popitem(last=False)
+				self._probation[demoted] = demoted_value
+			return value
+		return _MISSING
+
+	def _insert(self, key, value):
+		for segment in (self._window, self._probation, self._protected):
+			if key in segment:
+				segment[key] = value
+				return []
+
+		self._window[key] = value
+		if len(self._window) <= self._window_size:
+			return []
+		candidate, candidate_value = self._window.popitem(last=False)
+		if len(self._probation) + len(self._protected) < self._main_size:
+			self._probation[candidate] = candidate_value
+			return []
+
+		victims = self._probation or self._protected
+		if not victims:
+			return [(candidate, candidate_value)]
+		victim = next(iter(victims))
+		if self._sketch.frequency(candidate) > self._sketch.frequency(victim):
+			victim_value = victims.pop(victim)
+			self._probation[candidate] = candidate_value
+			return [(victim, victim_value)]
+		return [(candidate, candidate_value)]
+
+
+POLICIES = {
+	'lru': LRUCache,
+	'lfu': LFUCache,
+	'arc': ARCCache,
+	'tinylfu': TinyLFUCache,
+}
+
+
+class ShardedCache:
+	"""
+	Cache split into independent segments by key hash.
+
+	Each shard is a separate policy cache with its own lock, so threads
+	working on different keys rarely wait for each other. maxsize and
+	maxbytes are divided evenly (rounded up) between the shards: the
+	global limit is approximate, a skewed key distribution can evict
+	from a full shard while others still have room, and the total may
+	exceed maxsize by less than one entry per shard.
+	"""
+
+	def __init__(self, maxsize=128, shards=16, policy='lru', maxbytes=None, on_evict=None, **options):
+		if shards < 1 or shards & (shards - 1):
+			raise ValueError(f"shards must be a power of two, got {shards!r}")
+		self.maxsize = maxsize
+		self.maxbytes = maxbytes
+		self._mask = shards - 1
+		per_shard = {'on_evict': on_evict, **options}
+		if policy == 'lru' and maxbytes is not None:
+			per_shard['maxbytes'] = -(-maxbytes // shards)
+		shard_size = None if maxsize is None else -(-maxsize // shards)
+		self._shards = [POLICIES[policy](shard_size, **per_shard) for _ in range(shards)]
+		self._lock = threading.Lock()
+		self._sweeper = None
+		self._stopped = threading.Event()
 
+	def __len__(self):
+		# sum() is shadowed by the cached example function at the bottom of the module
+		total = 0
+		for shard in self._shards:
+			total += len(shard)
+		return total
 
-lru_cache = lru_cache_v2
+	def shard(self, key):
+		return self._shards[hash(key) & self._mask]
+
+	def get(self, key, default=_MISSING):
+		return self._shards[hash(key) & self._mask].get(key, default)
+
+	def put(self, key, value, ttl=None):
+		shard = self._shards[hash(key) & self._mask]
+		if ttl is None:
+			shard.put(key, value)
+		else:
+			shard.put(key, value, ttl)
+
+	@property
+	def currbytes(self):
+		total = 0
+		for shard in self._shards:
+			total += getattr(shard, 'currbytes', 0)
+		return total
+
+	def expire(self):
+		total = 0
+		for shard in self._shards:
+			if hasattr(shard, 'expire'):
+				total += shard.expire()
+		return total
+
+	start_sweeper = LRUCache.start_sweeper
+	stop_sweeper = LRUCache.stop_sweeper
+
+	def clear(self):
+		for shard in self._shards:
+			shard.clear()
+
+	def items(self, remaining=False):
+		items = []
+		for shard in self._shards:
+			items.extend(shard.items(remaining))
+		return items
+
+	def info(self):
+		hits = misses = currsize = 0
+		for shard in self._shards:
+			info = shard.info()
+			hits += info.hits
+			misses += info.misses
+			currsize += info.currsize
+		return CacheInfo(hits, misses, self.maxsize, currsize)
+
+
+class _Failure:
+	__slots__ = ('error', 'expires')
+
+	def __init__(self, error, expires):
+		self.error = error
+		self.expires = expires
+
+
+def _retrieve_error(task):
+	# Failures are re-raised to the callers; keep asyncio from logging them again
+	if not task.cancelled():
+		task.exception()
+
+
+def _async_wrapper(func, cache, typed, cache_failures, failure_ttl):
+	"""
+	Caches awaited results of a coroutine function.
+
+	Concurrent calls with the same key share one task, so a stampede of
+	identical lookups makes one call. Callers await it through shield:
+	one caller being cancelled does not cancel the others. Exceptions
+	are only cached with cache_failures, for failure_ttl seconds.
+	"""
+	flights = {}
+	cache_get = cache.get
+
+	async def load(key, args, kwargs):
+		try:
+			value = await func(*args, **kwargs)
+		except Exception as error:
+			if cache_failures:
+				expires = None if failure_ttl is None else time.monotonic() + failure_ttl
+				cache.put(key, _Failure(error, expires))
+			raise
+		else:
+			cache.put(key, value)
+			return value
+		finally:
+			flights.pop(key, None)
+
+	@wraps(func)
+	async def wrapper(*args, **kwargs):
+		key = _make_key(args, kwargs, typed)
+		value = cache_get(key)
+		if value is not _MISSING:
+			if type(value) is not _Failure:
+				return value
+			if value.expires is None or value.expires > time.monotonic():
+				raise value.error
+		flight = flights.get(key)
+		if flight is None:
+			flight = flights[key] = asyncio.ensure_future(load(key, args, kwargs))
+			flight.add_done_callback(_retrieve_error)
+		return await asyncio.shield(flight)
+
+	return wrapper
+
+
+_disk_stores = {}
+_disk_stores_lock = threading.Lock()
+
+
+def _disk_store(path, maxbytes):
+	# One connection per file for the whole process
+	with _disk_stores_lock:
+		store = _disk_stores.get(path)
+		if store is None:
+			store = _disk_stores[path] = DiskStore(path, maxbytes)
+		return store
+
+
+# Entries keep the expiry they got when computed: every move between the
+# tiers passes on the seconds left rather than starting a new ttl
+
+def _spill_to(store, namespace, on_evict):
+	def spill(key, value, reason, ttl_left=None):
+		if reason != 'expired':
+			store.put(namespace, key, value, ttl_left)
+		if on_evict is not None:
+			on_evict(key, value, reason)
+	spill.takes_ttl = True
+	return spill
+
+
+def _flush_to_disk(cache_ref, store, namespace):
+	cache = cache_ref()
+	if cache is not None:
+		store.put_many(namespace, cache.items(remaining=True))
+
+
+def _put_remaining(cache, key, value, ttl_left):
+	if ttl_left is None:
+		cache.put(key, value)
+	else:
+		cache.put(key, value, ttl_left)
+
+
+def _disk_wrapper(func, cache, typed, store, namespace, maxsize):
+	"""Memory tier in front of a DiskStore; see lru_cache_v3."""
+	cache_get = cache.get
+	for key, value, ttl_left in store.recent(namespace, maxsize):
+		_put_remaining(cache, key, value, ttl_left)
+	atexit.register(_flush_to_disk, weakref.ref(cache), store, namespace)
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		key = _make_key(args, kwargs, typed)
+		value = cache_get(key)
+		if value is _MISSING:
+			# Promote from disk; the disk copy stays for the next warm start
+			entry = store.get_entry(namespace, key)
+			if entry is None:
+				value = func(*args, **kwargs)
+				cache.put(key, value)
+			else:
+				value, ttl_left = entry
+				_put_remaining(cache, key, value, ttl_left)
+		return value
+
+	def cache_clear():
+		cache.clear()
+		store.clear(namespace)
+
+	wrapper.cache_clear = cache_clear
+	return wrapper
+
+
+def _lru_wrapper(func, cache):
+	"""
+	Wrapper for the common case: plain LRUCache, typed=False, no ttl.
+
+	_make_key and LRUCache.get are inlined, so a hit costs one call of
+	the wrapper itself and no allocation for positional calls.
+	"""
+	cache_map_get = cache._map.get
+	cache_put = cache.put
+	lock = cache._lock
+	root = cache._root
+
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		if kwargs:
+			key = (*args, _KWD_MARK, *kwargs, *kwargs.values())
+		elif len(args) == 1 and type(args[0]) in _FAST_TYPES:
+			key = args[0]
+		else:
+			key = args
+		link = cache_map_get(key)
+		if link is not None:
+			if lock.acquire(False):
+				if link.next is not None:
+					link.prev.next = link.next
+					link.next.prev = link.prev
+					link.prev = last = root.prev
+					link.next = root
+					last.next = root.prev = link
+				lock.release()
+			cache.hits += 1
+			return link.value
+		cache.misses += 1
+		value = func(*args, **kwargs)
+		cache_put(key, value)
+		return value
+
+	return wrapper
+
+
+def lru_cache_v3(maxsize=128, typed=False, *, policy='lru', maxbytes=None, sizeof=None, ttl=None,
+				 on_evict=None, sweep_interval=None, shards=None, disk=None, disk_maxbytes=64 * 1024 * 1024,
+				 disk_namespace=None, cache_failures=False, failure_ttl=None):
+	"""
+	Memoizing decorator on top of LRUCache or another POLICIES entry.
+
+	policy picks the eviction policy: 'lru', 'lfu', 'arc' or 'tinylfu'.
+	maxbytes/sizeof and ttl are passed to LRUCache and are only
+	supported with policy='lru'; on_evict works with every policy. With
+	ttl and sweep_interval set, a daemon thread drops expired results
+	every sweep_interval seconds instead of waiting for the next call.
+
+	shards=N (a power of two) splits the cache into N ShardedCache
+	segments with their own locks, for functions called from many
+	threads at once; maxsize and maxbytes become approximate.
+
+	disk (an sqlite file path or a DiskStore) adds a second tier:
+	results evicted from memory are written there, a memory miss checks
+	it before calling func, the memory contents are written back at
+	interpreter exit, and the decorator preloads the most recently used
+	maxsize entries, so a restarted process starts warm. disk_maxbytes
+	limits the file when a path is given (None: unlimited). Arguments
+	and results that cannot be pickled simply stay memory-only.
+	Entries are stored under disk_namespace, by default the function's
+	module and qualified name; lambdas and nested functions must pass
+	one, since all of them with the same name would share results.
+
+	On an async def the awaited result is cached rather than the
+	coroutine object, and concurrent calls with the same arguments share
+	one in-flight call (see _async_wrapper). Only there, cache_failures
+	also caches raised exceptions for failure_ttl seconds (default: until
+	evicted).
+	"""
+	if policy not in POLICIES:
+		raise ValueError(f"Unknown policy {policy!r}, expected one of: {', '.join(POLICIES)}")
+	if policy != 'lru' and (maxbytes is not None or ttl is not None):
+		raise ValueError("maxbytes and ttl are only supported with policy='lru'")
+
+	def deco(func):
+		is_async = inspect.iscoroutinefunction(func)
+		if cache_failures and not is_async:
+			raise TypeError("cache_failures is only supported for coroutine functions")
+		if disk is not None and is_async:
+			raise TypeError("disk is not supported for coroutine functions")
+
+		evict = on_evict
+		if disk is not None:
+			store = disk if isinstance(disk, DiskStore) else _disk_store(disk, disk_maxbytes)
+			namespace = disk_namespace
+			if namespace is None:
+				if '<lambda>' in func.__qualname__ or '<locals>' in func.__qualname__:
+					raise ValueError(
+						f"{func.__qualname__} has no unique name, pass disk_namespace to cache it on disk"
+					)
+				namespace = f'{func.__module__}.{func.__qualname__}'
+			evict = _spill_to(store, namespace, on_evict)
+
+		options = {'maxbytes': maxbytes, 'sizeof': sizeof, 'ttl': ttl} if policy == 'lru' else {}
+		if shards is not None:
+			cache = ShardedCache(maxsize, shards, policy, on_evict=evict, **options)
+		else:
+			cache = POLICIES[policy](maxsize, on_evict=evict, **options)
+		if ttl is not None and sweep_interval is not None:
+			cache.start_sweeper(sweep_interval)
+
+		if is_async:
+			wrapper = _async_wrapper(func, cache, typed, cache_failures, failure_ttl)
+		elif disk is not None:
+			wrapper = _disk_wrapper(func, cache, typed, store, namespace, maxsize)
+		elif type(cache) is LRUCache and ttl is None and not typed:
+			wrapper = _lru_wrapper(func, cache)
+		else:
+			cache_get, cache_put = cache.get, cache.put
+
+			@wraps(func)
+			def wrapper(*args, **kwargs):
+				key = _make_key(args, kwargs, typed)
+				value = cache_get(key)
+				if value is _MISSING:
+					value = func(*args, **kwargs)
+					cache_put(key, value)
+				return value
+
+		wrapper.cache_info = cache.info
+		wrapper.cache_clear = wrapper.cache_clear if disk is not None else cache.clear
+		wrapper.cache = cache
+		return wrapper
+
+	if callable(maxsize):
+		func, maxsize = maxsize, 128
+		return deco(func)
+	return deco
+
+
+lru_cache = lru_cache_v3
 
 @lru_cache
 def sum(a: int, b: int) -> int:
@@ -117,3 +1105,241 @@ if __name__ == '__main__':
     assert decorated(5, 6) == 3
     assert decorated(1, 2) == 4
     assert mocked_func.call_count == 4
+
+    mocked_func = unittest.mock.Mock()
+    mocked_func.side_effect = [None, 1]
+
+    decorated = lru_cache(maxsize=2)(mocked_func)
+    assert decorated(1) is None
+    assert decorated(1) is None
+    assert mocked_func.call_count == 1
+    assert decorated.cache_info() == (1, 1, 2, 1)
+    decorated.cache_clear()
+    assert decorated.cache_info() == (0, 0, 2, 0)
+    assert decorated(1) == 1
+
+    # A value too large to store replaces the old one with nothing
+    cache = LRUCache(maxsize=4, maxbytes=2000, sizeof=len)
+    cache.put('a', 'x')
+    cache.put('a', 'y' * 5000)
+    assert cache.get('a', None) is None and len(cache) == 0 and cache.currbytes == 0
+
+    # A hit that looked the link up before clear() must not put it back in the list
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    stale = cache._map['a']
+    cache.clear()
+    assert stale.next is None and stale.prev is None
+    for key in 'xyz':
+        cache.put(key, key)
+    assert cache.items() == [('y', 'y'), ('z', 'z')]
+
+    mocked_func = unittest.mock.Mock()
+    mocked_func.side_effect = lambda x: x * 2
+
+    decorated = lru_cache(typed=True)(mocked_func)
+    assert decorated(1) == 2
+    assert decorated(1.0) == 2.0
+    assert mocked_func.call_count == 2
+
+    decorated = lru_cache(maxsize=16)(lambda x: x)
+    threads = [
+        threading.Thread(target=lambda: [decorated(i % 32) for i in range(10000)])
+        for _ in range(8)
+    ]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert decorated.cache_info().currsize == 16
+
+    evicted = []
+    now = [0.0]
+    cache = LRUCache(
+        maxsize=None, maxbytes=3 * (100 + _ENTRY_OVERHEAD), sizeof=len, ttl=10,
+        on_evict=lambda key, value, reason: evicted.append((key, reason)), clock=lambda: now[0]
+    )
+    for key in 'abc':
+        cache.put(key, b'x' * 100)
+    assert cache.currbytes == 3 * (100 + _ENTRY_OVERHEAD)
+    cache.get('a')
+    cache.put('d', b'x' * 100)
+    assert evicted == [('b', 'bytes')]
+    cache.put('e', b'x' * 1000)
+    assert cache.get('e') is _MISSING and len(cache) == 3
+    now[0] = 5
+    cache.put('a', b'y' * 50)
+    now[0] = 12
+    assert cache.get('c') is _MISSING
+    assert cache.expire() == 1
+    assert evicted[1:] == [('c', 'expired'), ('d', 'expired')]
+    assert cache.get('a') == b'y' * 50 and cache.currbytes == 50 + _ENTRY_OVERHEAD
+
+    assert deep_sizeof([b'x' * 100, b'x' * 100]) > 2 * 100
+    payload = 'x' * 100
+    assert deep_sizeof([payload, payload]) == sys.getsizeof([payload, payload]) + sys.getsizeof(payload)
+
+    mocked_func = unittest.mock.Mock()
+    mocked_func.side_effect = [1, 2]
+    decorated = lru_cache(ttl=0.05, sweep_interval=0.01)(mocked_func)
+    assert decorated('x') == 1
+    assert decorated('x') == 1
+    time.sleep(0.1)
+    assert decorated.cache_info().currsize == 0
+    assert decorated('x') == 2
+
+    cache = LFUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is _MISSING and cache.get('a') == 1 and cache.get('c') == 3
+
+    rng = random.Random(0)
+    for name, policy in POLICIES.items():
+        evicted = []
+        cache = policy(maxsize=100, on_evict=lambda key, value, reason: evicted.append(key))
+        for _ in range(20000):
+            key = rng.randrange(300)
+            if cache.get(key) is _MISSING:
+                cache.put(key, key)
+            assert len(cache) <= 100, name
+        assert cache.info().currsize == len(cache) and len(evicted) > 0, name
+
+        # Hot keys seen many times, then a one-off scan twice the cache size
+        hot = range(50)
+        cache = policy(maxsize=100)
+        for _ in range(20):
+            for key in hot:
+                if cache.get(key) is _MISSING:
+                    cache.put(key, key)
+        for key in range(1000, 1200):
+            if cache.get(key) is _MISSING:
+                cache.put(key, key)
+        hits_after_scan = len([key for key in hot if cache.get(key) is not _MISSING])
+        assert hits_after_scan == (0 if name == 'lru' else 50), (name, hits_after_scan)
+
+    decorated = lru_cache(maxsize=2, policy='arc')(lambda x: x * 2)
+    assert decorated(2) == 4 and decorated(2) == 4
+    assert decorated.cache_info() == (1, 1, 2, 1)
+    try:
+        lru_cache(policy='lfu', ttl=1)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ttl with policy=lfu must fail')
+
+    calls = []
+
+    @lru_cache(ttl=0.05)
+    async def lookup(code):
+        calls.append(code)
+        await asyncio.sleep(0.01)
+        if code == 'XXX':
+            raise KeyError(code)
+        return code.lower()
+
+    async def stampede():
+        results = await asyncio.gather(*[lookup('USD') for _ in range(100)])
+        assert results == ['usd'] * 100 and calls == ['USD']
+        assert await lookup('USD') == 'usd' and calls == ['USD']
+        for _ in range(2):
+            try:
+                await lookup('XXX')
+            except KeyError:
+                pass
+        assert calls == ['USD', 'XXX', 'XXX']
+        await asyncio.sleep(0.06)
+        assert await lookup('USD') == 'usd' and calls[-1] == 'USD' and len(calls) == 4
+
+    asyncio.run(stampede())
+
+    failing = unittest.mock.AsyncMock(side_effect=[ValueError('down'), 'up'])
+    decorated = lru_cache(cache_failures=True, failure_ttl=0.05)(failing)
+
+    async def failures():
+        for _ in range(3):
+            try:
+                await decorated('x')
+            except ValueError:
+                pass
+        assert failing.await_count == 1
+        await asyncio.sleep(0.06)
+        assert await decorated('x') == 'up' and failing.await_count == 2
+
+    asyncio.run(failures())
+
+    cache = ShardedCache(maxsize=64, shards=8)
+    for key in range(1000):
+        cache.put(key, key)
+    assert 56 <= len(cache) <= 64 and cache.get(999) == 999
+    assert cache.info().currsize == len(cache) and cache.info().hits == 1
+
+    decorated = lru_cache(maxsize=64, shards=4, ttl=10)(lambda x: x * 2)
+    threads = [
+        threading.Thread(target=lambda: [decorated(i % 128) for i in range(5000)])
+        for _ in range(8)
+    ]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert decorated.cache_info().currsize <= 64
+    assert decorated(3) == 6
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cache.sqlite')
+        calls = []
+
+        def square(x):
+            calls.append(x)
+            return {'square': x * x}
+
+        decorated = lru_cache(maxsize=2, disk=path)(square)
+        for x in (1, 2, 3, 1):
+            assert decorated(x) == {'square': x * x}
+        assert calls == [1, 2, 3] and decorated.cache_info().currsize == 2
+
+        # Simulate a restart: flush what atexit would, then decorate again
+        store = _disk_store(path, None)
+        _flush_to_disk(weakref.ref(decorated.cache), store, f'{__name__}.square')
+        restarted = lru_cache(maxsize=2, disk=path)(square)
+        assert restarted.cache_info().currsize == 2
+        assert [restarted(x) for x in (1, 2, 3)] == [{'square': 1}, {'square': 4}, {'square': 9}]
+        assert calls == [1, 2, 3]
+
+        # Moving between memory and disk keeps the original expiry
+        def cube(x):
+            calls.append(x)
+            return x ** 3
+
+        short = lru_cache(maxsize=1, ttl=0.3, disk=path)(cube)
+        calls.clear()
+        for _ in range(9):
+            short(1)
+            short(2)
+            time.sleep(0.1)
+        assert calls.count(1) >= 3 and calls.count(2) >= 3
+
+        small = DiskStore(os.path.join(directory, 'small.sqlite'), maxbytes=1000)
+        for key in range(10):
+            # The row just written is never the one evicted, and only the overshoot goes
+            assert small.put('ns', key, b'x' * 300) and small.get('ns', key) == b'x' * 300
+        assert small.currbytes == 900 and small.get('ns', 7) == b'x' * 300 and small.get('ns', 0) is None
+        assert small.put('ns', 'lock', threading.Lock()) is False
+        small.close()
+
+        # Keyword calls are found again after a restart too
+        power = lru_cache(maxsize=4, disk=path, disk_namespace='power')(lambda x, exp=2: x ** exp)
+        power(2, exp=3)
+        _flush_to_disk(weakref.ref(power.cache), store, 'power')
+        power = lru_cache(maxsize=4, disk=path, disk_namespace='power')(lambda x, exp=2: calls.append(x))
+        assert power(2, exp=3) == 8 and power.cache_info().hits == 1
+
+        # Lambdas and closures have no name of their own to store results under
+        try:
+            lru_cache(disk=path)(lambda x: x)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('a lambda needs disk_namespace')
+
+        unlimited = lru_cache(maxsize=1, disk=os.path.join(directory, 'unlimited.sqlite'), disk_maxbytes=None)(square)
+        assert [unlimited(x)['square'] for x in (4, 5, 4)] == [16, 25, 16]
+        store.close()
@@ -1,13 +1,22 @@
-from random import randint
+import atexit
+import os
+import threading
+from inspect import signature
+from random import Random
 from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool, Process, Queue
-from time import perf_counter
-from functools import wraps
-from pprint import pp
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter, process_time
+from collections import deque
+from itertools import islice
+from math import isqrt
 
-def generate_data(n):
+import numpy as np
+
+def generate_data(n, low=1, high=1000, seed=None):
+    rng = Random(seed)
     for _ in range(n):
-        yield randint(1, 1000)
+        yield rng.randint(low, high)
 
 def is_prime(n):
     if n == 2 or n == 3: return True
@@ -22,31 +31,132 @@ def is_prime(n):
         f += 6
     return True
 
-queue = []
-
-def timer(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        t1 = perf_counter()
-        result = func(*args, **kwargs)
-        elapsed = perf_counter() - t1
-        queue.append((func.__name__, args[0], elapsed))
-        return result
-    return wrapper
+# Below this trial division is faster than Miller-Rabin
+TRIAL_DIVISION_LIMIT = 1 << 17
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61)
+# (bound, bases): testing these bases is enough for every n < bound
+MILLER_RABIN_WITNESSES = (
+    (3_215_031_751, (2, 3, 5, 7)),
+    (3_474_749_660_383, (2, 3, 5, 7, 11, 13)),
+    (341_550_071_728_321, (2, 3, 5, 7, 11, 13, 17)),
+    (1 << 64, (2, 325, 9375, 28178, 450775, 9780504, 1795265022)),
+)
+
+def is_prime_miller_rabin(n):
+    """Deterministic primality test for n < 2**64 in O(log^3 n)."""
+    if n < TRIAL_DIVISION_LIMIT:
+        return is_prime(n)
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return False
+
+    for bound, bases in MILLER_RABIN_WITNESSES:
+        if n < bound:
+            break
+    else:
+        raise ValueError(f"is_prime_miller_rabin is deterministic only below 2**64, got {n}")
+
+    # n - 1 = d * 2**s with odd d
+    d = n - 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+    for a in bases:
+        a %= n
+        if a == 0:
+            continue
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
 
-@timer
-def thread_pool_executor_solution(n, data_set):
+# Above this a full sieve gets too big (one byte per number), switch to segments
+SIEVE_LIMIT = 10**7
+SEGMENT_SIZE = 1 << 20
+
+def prime_sieve(limit):
+    """Boolean array where sieve[k] tells whether k is prime, 0 <= k <= limit."""
+    sieve = np.ones(limit + 1, dtype=bool)
+    sieve[:2] = False
+    sieve[4::2] = False
+    for p in range(3, isqrt(limit) + 1, 2):
+        if sieve[p]:
+            sieve[p*p::2*p] = False
+    return sieve
+
+def segmented_prime_mask(values, base_primes, segment_size=SEGMENT_SIZE):
+    """
+    Primality of values too large for one sieve.
+
+    Only the segments [k*segment_size, (k+1)*segment_size) that contain
+    some value are sieved, with base_primes up to sqrt(max(values)).
+    """
+    result = np.zeros(values.shape, dtype=bool)
+    segments = values // segment_size
+    for segment in np.unique(segments):
+        low = int(segment) * segment_size
+        is_prime_segment = np.ones(segment_size, dtype=bool)
+        for p in base_primes.tolist():
+            if p * p >= low + segment_size:
+                break
+            # First multiple of p in the segment, but not p itself
+            start = max(p * p, (low + p - 1) // p * p)
+            is_prime_segment[start - low::p] = False
+        if low < 2:
+            is_prime_segment[:2 - low] = False
+        in_segment = segments == segment
+        result[in_segment] = is_prime_segment[values[in_segment] - low]
+    return result
+
+def trial_division_mask(values, base_primes, chunk_cells=1 << 22):
+    """Primality of values by dividing all of them by base_primes at once, in chunks."""
+    result = np.zeros(values.shape, dtype=bool)
+    rows = max(1, chunk_cells // max(len(base_primes), 1))
+    for start in range(0, len(values), rows):
+        chunk = values[start:start + rows, None]
+        divisible = (chunk % base_primes == 0) & (chunk != base_primes)
+        result[start:start + rows] = ~divisible.any(axis=1) & (chunk[:, 0] >= 2)
+    return result
+
+def is_prime_batch(data):
+    """Primality of every number in data as a boolean array, via one sieve lookup."""
+    values = np.asarray(data, dtype=np.int64)
+    if values.size == 0:
+        return np.zeros(0, dtype=bool)
+    # Negative numbers are not prime: map them to 0
+    values = np.maximum(values, 0)
+    top = int(values.max())
+    if top <= SIEVE_LIMIT:
+        return prime_sieve(max(top, 1))[values]
+
+    root = isqrt(top) + 1
+    if root > SIEVE_LIMIT:
+        # Base primes would not fit in memory: test each number instead
+        return np.fromiter(map(is_prime_miller_rabin, values.tolist()), dtype=bool, count=values.size)
+    base_primes = np.flatnonzero(prime_sieve(root))
+    # Sieving a segment costs a Python step per base prime, dividing costs
+    # a vectorized step per value and base prime: sieve only dense batches
+    segment_count = len(np.unique(values // SEGMENT_SIZE))
+    if values.size > 1000 * segment_count:
+        return segmented_prime_mask(values, base_primes)
+    return trial_division_mask(values, base_primes)
+
+def thread_pool_executor_solution(n, data_set, check=is_prime):
     with ThreadPoolExecutor() as pool:
-        results = pool.map(is_prime, data_set)
+        results = pool.map(check, data_set)
     # Force evaluation of generator
     list(results)
 
-@timer
-def multiprocessing_pool_solution(n, data_set):
+def multiprocessing_pool_solution(n, data_set, check=is_prime):
     with Pool(8) as pool:
-        results = pool.map(is_prime, data_set)
+        results = pool.map(check, data_set)
 
-def is_prime_batched(in_queue, out_queue):
+def is_prime_batched(in_queue, out_queue, check=is_prime):
     while True:
         try:
             numbers = in_queue.get(timeout=1)
@@ -54,13 +164,12 @@ def is_prime_batched(in_queue, out_queue):
                 break
             result = []
             for n in numbers:
-                result.append((n, is_prime(n)))
+                result.append((n, check(n)))
             out_queue.put(result)
         except Exception as e:
             break
 
-@timer
-def multiprocessing_process_solution(n, data_set):
+def multiprocessing_process_solution(n, data_set, check=is_prime):
     DOP = 8
     in_queue = Queue()
     out_queue = Queue()
@@ -75,7 +184,7 @@ def multiprocessing_process_solution(n, data_set):
     for _ in range(DOP):
         in_queue.put(None)
     
-    processes = [Process(target=is_prime_batched, args=(in_queue, out_queue)) 
+    processes = [Process(target=is_prime_batched, args=(in_queue, out_queue, check)) 
                  for _ in range(DOP)]
     
     [proc.start() for proc in processes]
@@ -86,185 +195,288 @@ def multiprocessing_process_solution(n, data_set):
     
     [proc.join() for proc in processes]
 
-@timer
-def singlethreaded_solution(n, data_set):
+def is_prime_shared(in_name, out_name, size, start, stop, check=is_prime):
+    """Tests numbers[start:stop] from shared memory and writes their bits to the shared bitmap."""
+    in_shm = SharedMemory(name=in_name)
+    out_shm = SharedMemory(name=out_name)
+    try:
+        numbers = np.ndarray((size,), dtype=np.int64, buffer=in_shm.buf)
+        bitmap = np.ndarray((out_shm.size,), dtype=np.uint8, buffer=out_shm.buf)
+        flags = np.fromiter(map(check, numbers[start:stop].tolist()), dtype=bool, count=stop - start)
+        # start is a multiple of 8, so this worker owns whole bytes of the bitmap
+        packed = np.packbits(flags)
+        bitmap[start // 8:start // 8 + len(packed)] = packed
+        del numbers, bitmap
+    finally:
+        in_shm.close()
+        out_shm.close()
+
+def shared_memory_solution(n, data_set, check=is_prime):
+    DOP = 8
+    size = len(data_set)
+    in_shm = SharedMemory(create=True, size=max(size * 8, 1))
+    out_shm = SharedMemory(create=True, size=max((size + 7) // 8, 1))
+    try:
+        numbers = np.ndarray((size,), dtype=np.int64, buffer=in_shm.buf)
+        numbers[:] = data_set
+        # No views may outlive the block: close() fails while the buffer is exported
+        del numbers
+
+        # Ranges aligned to 8 numbers: workers never share a bitmap byte
+        step = ((size + DOP - 1) // DOP + 7) // 8 * 8 or 8
+        processes = [
+            Process(target=is_prime_shared, args=(in_shm.name, out_shm.name, size, start, min(start + step, size), check))
+            for start in range(0, size, step)
+        ]
+        [proc.start() for proc in processes]
+        [proc.join() for proc in processes]
+        # A crashed worker leaves its bytes zero, which would read as "not prime"
+        failed = [proc.exitcode for proc in processes if proc.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(processes)} workers failed, exit codes: {failed}")
+
+        bitmap = np.ndarray((out_shm.size,), dtype=np.uint8, buffer=out_shm.buf)
+        results = np.unpackbits(bitmap, count=size).astype(bool)
+        del bitmap
+    finally:
+        in_shm.close()
+        in_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+    return results
+
+class AdaptiveExecutor:
+    """
+    Long-lived worker pools that pick how to run each map() call.
+
+    The thread and process pools are created on first use (or by
+    start()) and reused by every later call, so no call pays pool
+    startup twice. Each call first runs a small sample serially - its
+    results are kept - to measure the cost per item and how much of it
+    is CPU. Then:
+    - cheap batches run serially, no pool is involved;
+    - mostly-waiting work (I/O) goes to threads;
+    - CPU-bound work goes to processes when the estimated parallel time,
+      including pickling and dispatch, beats serial; chunksize is chosen
+      so each chunk carries at least CHUNK_SECONDS of work.
+    """
+    SAMPLE_SIZE = 64
+    SERIAL_SECONDS = 0.01
+    CHUNK_SECONDS = 0.005
+    # Rough cost of sending one item and its result between processes
+    IPC_ITEM_SECONDS = 2e-6
+    DISPATCH_SECONDS = 0.002
+
+    def __init__(self, processes=None, threads=32):
+        self.processes = processes or os.cpu_count() or 1
+        self.threads = threads
+        self.last_plan = None
+        self._process_pool = None
+        self._thread_pool = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts both pools ahead of the first call."""
+        self._processes()
+        self._threads()
+        return self
+
+    def close(self):
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool.close()
+                self._process_pool.join()
+                self._process_pool = None
+            if self._thread_pool is not None:
+                self._thread_pool.shutdown()
+                self._thread_pool = None
+
+    def map(self, func, data):
+        data = list(data)
+        sample, rest = data[:self.SAMPLE_SIZE], data[self.SAMPLE_SIZE:]
+        wall, cpu = perf_counter(), process_time()
+        results = [func(item) for item in sample]
+        wall, cpu = perf_counter() - wall, process_time() - cpu
+
+        per_item = wall / max(len(sample), 1)
+        cpu_share = cpu / wall if wall > 0 else 1.0
+        mode, chunksize = self.last_plan = self.plan(per_item, cpu_share, len(rest))
+        if mode == 'serial':
+            results.extend(map(func, rest))
+        elif mode == 'thread':
+            results.extend(self._threads().map(func, rest))
+        else:
+            results.extend(self._processes().map(func, rest, chunksize))
+        return results
+
+    def submit(self, func, *args):
+        """Runs func(*args) in the process pool; returns its AsyncResult."""
+        return self._processes().apply_async(func, args)
+
+    def plan(self, per_item, cpu_share, count):
+        """(mode, chunksize) for count items costing per_item seconds each."""
+        serial = per_item * count
+        if serial < self.SERIAL_SECONDS:
+            return 'serial', None
+        if cpu_share < 0.5:
+            # Mostly waiting: threads overlap the waits without pickling
+            return 'thread', None
+        if self.processes > 1:
+            parallel = count * (per_item / self.processes + self.IPC_ITEM_SECONDS) + self.DISPATCH_SECONDS
+            if parallel < serial:
+                # Enough work per chunk to amortize IPC, but at least ~4 chunks per process
+                chunksize = max(int(self.CHUNK_SECONDS / per_item) + 1, -(-count // (self.processes * 4)))
+                return 'process', min(chunksize, count)
+        return 'serial', None
+
+    def _processes(self):
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = Pool(self.processes)
+                atexit.register(self.close)
+            return self._process_pool
+
+    def _threads(self):
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.threads)
+            return self._thread_pool
+
+engine = AdaptiveExecutor()
+
+def adaptive_pool_solution(n, data_set, check=is_prime):
+    results = engine.map(check, data_set)
+
+STREAM_CHUNK_SIZE = 1 << 16
+
+def chunked(iterable, size):
+    """Lists of up to size items from iterable, read lazily."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def check_chunk(numbers, check=is_prime):
+    """Packed bitmap of check() over numbers: 1 bit per number crosses the process boundary."""
+    return np.packbits(np.fromiter(map(check, numbers), dtype=bool, count=len(numbers))).tobytes()
+
+def stream_primes(data, check=is_prime, chunk_size=STREAM_CHUNK_SIZE, max_pending=None, sink=None):
+    """
+    Tests a lazily generated stream of numbers in bounded memory.
+
+    data is read chunk_size numbers at a time and chunks go to the
+    engine's process pool; at most max_pending chunks are in flight, so
+    a slow pool stops reading from data instead of buffering it.
+    Results are reduced in order as they arrive: the counts are
+    returned, and sink(numbers, bitmap) gets every chunk with its packed
+    prime bitmap (chunk_size is a multiple of 8, so bitmaps of
+    consecutive chunks can simply be concatenated).
+
+    Returns (total, primes).
+    """
+    if chunk_size % 8:
+        raise ValueError(f"chunk_size must be a multiple of 8, got {chunk_size}")
+    max_pending = max_pending or 2 * engine.processes
+    total = primes = 0
+
+    def reduce(numbers, bitmap):
+        nonlocal total, primes
+        total += len(numbers)
+        primes += int(np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8), count=len(numbers)).sum())
+        if sink is not None:
+            sink(numbers, bitmap)
+
+    if engine.processes == 1:
+        # Nothing to overlap with: skip the pickling round trip
+        for numbers in chunked(data, chunk_size):
+            reduce(numbers, check_chunk(numbers, check))
+        return total, primes
+
+    pending = deque()
+    for numbers in chunked(data, chunk_size):
+        if len(pending) >= max_pending:
+            done_numbers, result = pending.popleft()
+            reduce(done_numbers, result.get())
+        pending.append((numbers, engine.submit(check_chunk, numbers, check)))
+    while pending:
+        done_numbers, result = pending.popleft()
+        reduce(done_numbers, result.get())
+    return total, primes
+
+def streaming_solution(n, data, check=is_prime, sink=None):
+    return stream_primes(data, check, sink=sink)
+
+def singlethreaded_solution(n, data_set, check=is_prime):
     results = []
     for n in data_set:
-        results.append((n, is_prime(n)))
+        results.append((n, check(n)))
+
+def numpy_sieve_solution(n, data_set):
+    results = is_prime_batch(data_set)
 
         
 
-def main(n):
+# Every solution takes (n, data_set); those that accept check= can use another primality backend
+SOLUTIONS = {
+    'thread_pool_executor_solution': thread_pool_executor_solution,
+    'multiprocessing_pool_solution': multiprocessing_pool_solution,
+    'multiprocessing_process_solution': multiprocessing_process_solution,
+    'adaptive_pool_solution': adaptive_pool_solution,
+    'shared_memory_solution': shared_memory_solution,
+    'streaming_solution': streaming_solution,
+    'singlethreaded_solution': singlethreaded_solution,
+    'numpy_sieve_solution': numpy_sieve_solution,
+}
+
+def run_solution(name, n, data_set, check=is_prime):
+    """Runs one solution; returns False if it cannot use check."""
+    solution = SOLUTIONS[name]
+    if 'check' in signature(solution).parameters:
+        solution(n, data_set, check=check)
+    elif check is is_prime:
+        solution(n, data_set)
+    else:
+        return False
+    return True
+
+def main(n, low=1, high=1000, check=is_prime):
     print(f"\n{'='*50}")
-    print(f"Testing with n = {n}")
+    print(f"Testing with n = {n}, numbers in [{low}, {high}], {check.__name__}")
     print('='*50)
     
-    data_set = list(generate_data(n))
-    
-    print("Running thread_pool_executor_solution...")
-    thread_pool_executor_solution(n, data_set)
-    
-    print("Running multiprocessing_pool_solution...")
-    multiprocessing_pool_solution(n, data_set)
-    
-    print("Running multiprocessing_process_solution...")
-    multiprocessing_process_solution(n, data_set)
-
-    print("Running singlethreaded_solution...")
-    singlethreaded_solution(n, data_set)
+    data_set = list(generate_data(n, low, high))
+
+    for name in SOLUTIONS:
+        started = perf_counter()
+        if run_solution(name, n, data_set, check):
+            print(f"{name:<35} {perf_counter() - started:.6f} s")
+            if name == 'adaptive_pool_solution':
+                print(f"  plan: {engine.last_plan}")
     
     print(f"Completed n = {n}")
 
+def main_streaming(n, low=1, high=1000, check=is_prime):
+    print(f"\n{'='*50}")
+    print(f"Streaming n = {n}, numbers in [{low}, {high}], {check.__name__}")
+    print('='*50)
+
+    # The data is never materialized: memory stays flat for any n
+    started = perf_counter()
+    total, primes = streaming_solution(n, generate_data(n, low, high), check=check)
+    print(f"Completed n = {n}: {primes} primes of {total} in {perf_counter() - started:.3f} s")
+
 if __name__ == '__main__':
+    # Quick single-sample run. Repeated seeded timings, JSON/CSV, baseline
+    # comparison and charts: python bench_primes.py --help
+    engine.start()
     main(1000)
     main(10000)
     main(100000)
     main(1000000)
     main(10000000)
-    # main(100000000)
-    
-    print("\n" + "="*50)
-    print("Timing Results:")
-    print("="*50)
-    # pp(queue)
-
-
-    import matplotlib.pyplot as plt
-    import numpy as np
-
-    data = queue
-
-    # Extract unique categories
-    methods = list(set(item[0] for item in data))
-    methods.sort()  # Sort for consistent ordering
-
-    # Group data by method
-    grouped_data = {}
-    for method, size, time in data:
-        if method not in grouped_data:
-            grouped_data[method] = {'sizes': [], 'times': []}
-        grouped_data[method]['sizes'].append(size)
-        grouped_data[method]['times'].append(time)
-
-    # Sort each group by size
-    for method in grouped_data:
-        sizes = grouped_data[method]['sizes']
-        times = grouped_data[method]['times']
-        # Sort by size
-        sorted_pairs = sorted(zip(sizes, times))
-        grouped_data[method]['sizes'] = [x[0] for x in sorted_pairs]
-        grouped_data[method]['times'] = [x[1] for x in sorted_pairs]
-
-    # Create the plot
-    plt.figure(figsize=(12, 8))
-
-    # Color scheme
-    colors = {
-        'thread_pool_executor_solution': 'blue',
-        'multiprocessing_pool_solution': 'green',
-        'multiprocessing_process_solution': 'red',
-        'singlethreaded_solution': 'yellow',
-    }
-
-    # Line styles and markers
-    line_styles = ['-', '--', '-.', ':']
-    markers = ['o', 's', '^', '*']
-
-    # Plot each method
-    for idx, method in enumerate(methods):
-        sizes = grouped_data[method]['sizes']
-        times = grouped_data[method]['times']
-        
-        plt.plot(sizes, times, 
-                 label=method.replace('_', ' ').title(),
-                 color=colors[method],
-                 linestyle=line_styles[idx % len(line_styles)],
-                 marker=markers[idx % len(markers)],
-                 linewidth=2,
-                 markersize=8)
-
-    # Set log scale for x-axis (since sizes are powers of 10)
-    plt.xscale('log')
-    plt.yscale('log')  # Also log scale for y-axis to better show differences
-
-    # Set labels and title
-    plt.xlabel('Input Size', fontsize=14)
-    plt.ylabel('Execution Time (seconds)', fontsize=14)
-    plt.title('Performance Comparison of Parallelization Methods', fontsize=16, fontweight='bold')
-
-    # Add grid
-    plt.grid(True, which="both", ls="--", alpha=0.3)
-
-    # Add legend
-    plt.legend(fontsize=12)
-
-    # Adjust layout
-    plt.tight_layout()
-
-    # Show plot
-    plt.show()
-
-    # Alternatively, you can create a grouped bar chart for better comparison
-    plt.figure(figsize=(14, 8))
-
-    # Prepare data for grouped bars
-    unique_sizes = sorted(list(set(item[1] for item in data)))
-    x = np.arange(len(unique_sizes))
-    width = 0.25
-
-    # Create bars for each method
-    for idx, method in enumerate(methods):
-        times = []
-        for size in unique_sizes:
-            # Find the time for this method and size
-            time = next((item[2] for item in data if item[0] == method and item[1] == size), 0)
-            times.append(time)
-        
-        # Calculate bar positions
-        positions = x + (idx - 1) * width
-        
-        plt.bar(positions, times, width, 
-                label=method.replace('_', ' ').title(),
-                color=colors[method],
-                alpha=0.8)
-
-    # Set x-axis labels
-    plt.xlabel('Input Size', fontsize=14)
-    plt.ylabel('Execution Time (seconds)', fontsize=14)
-    plt.title('Performance Comparison - Grouped Bar Chart', fontsize=16, fontweight='bold')
-    plt.xticks(x, [str(size) for size in unique_sizes])
-    plt.yscale('log')  # Use log scale for better visualization
-
-    # Add legend
-    plt.legend(fontsize=12)
-
-    # Add grid
-    plt.grid(True, axis='y', alpha=0.3, linestyle='--')
-
-    # Add value labels on bars (only for significant values)
-    for idx, method in enumerate(methods):
-        times = []
-        for size in unique_sizes:
-            time = next((item[2] for item in data if item[0] == method and item[1] == size), 0)
-            times.append(time)
-        
-        positions = x + (idx - 1) * width
-        for pos, time in zip(positions, times):
-            if time > 0.01:  # Only label if time is significant
-                plt.text(pos, time * 1.1, f'{time:.3f}', 
-                        ha='center', va='bottom', fontsize=9, rotation=45)
-
-    plt.tight_layout()
-    plt.show()
-
-    # Create a table summary
-    print("\n" + "="*80)
-    print("PERFORMANCE SUMMARY TABLE")
-    print("="*80)
-    print(f"{'Method':<35} {'Size':<15} {'Time (s)':<15}")
-    print("-"*80)
-
-    for method, size, time in sorted(data, key=lambda x: (x[0], x[1])):
-        print(f"{method:<35} {size:<15} {time:<15.6f}")
-
-    print("="*80)
\ No newline at end of file
+    main_streaming(100000000)
+
+    # Large numbers: trial division would need up to 10^9 steps per number
+    main(1000, 10**12, 10**18, check=is_prime_miller_rabin)
+    main(10000, 10**12, 10**18, check=is_prime_miller_rabin)
+    main(100000, 10**12, 10**18, check=is_prime_miller_rabin)
+    main(1000000, 10**12, 10**18, check=is_prime_miller_rabin)
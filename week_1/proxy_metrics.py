@@ -0,0 +1,248 @@
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = 'metrics'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield self.name + _labels(self.labelnames, labelvalues), value
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться."""
+    kind = 'gauge'
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labelvalues -> [счётчики по корзинам (последняя - +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labelvalues, list(counts), total) for labelvalues, (counts, total) in self._values.items()]
+        for labelvalues, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(self.labelnames, labelvalues, [('le', _number(bound))]), cumulative
+            yield self.name + '_sum' + _labels(self.labelnames, labelvalues), total
+            yield self.name + '_count' + _labels(self.labelnames, labelvalues), cumulative
+
+
+class Registry:
+    """
+    Набор метрик процесса и их вывод в текстовом формате Prometheus.
+
+    Кроме обычных метрик можно зарегистрировать collector - функцию,
+    которая при каждом запросе /metrics возвращает метрики, снятые в
+    момент вызова (например, состояние пулов соединений).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """collector() возвращает список метрик, собранных в момент вызова."""
+        self._collectors.append(collector)
+
+    def render(self):
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            metrics.extend(collector())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for sample, value in metric.samples():
+                lines.append(f'{sample} {_number(value)}')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+# Общие метрики обоих прокси; у каждого процесса свои значения
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter(
+    'currency_proxy_requests_total', 'Processed HTTP requests.', ('route', 'status')
+)
+REQUEST_DURATION = REGISTRY.histogram(
+    'currency_proxy_request_duration_seconds', 'End-to-end request handling time.', ('route',)
+)
+IN_FLIGHT = REGISTRY.gauge(
+    'currency_proxy_requests_in_flight', 'Requests being handled right now.'
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    'currency_proxy_upstream_duration_seconds', 'Exchange rate API call time.', ('outcome',)
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    'currency_proxy_upstream_in_flight', 'Exchange rate API calls in progress.'
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    'currency_proxy_cache_lookups_total', 'Rate cache lookups by result (hit, stale, miss).', ('result',)
+)
+
+
+def route_label(path):
+    """Метка маршрута с ограниченным числом значений."""
+    # Не на уровне модуля: batch_rates через upstream сам импортирует этот модуль
+    from batch_rates import BATCH_PATH
+    path = path.strip('/')
+    if path in (METRICS_PATH, BATCH_PATH):
+        return path
+    return 'currency' if path else 'root'
+
+
+def cache_lookup(result):
+    """Передаётся кэшам курсов как on_lookup."""
+    CACHE_LOOKUPS.inc(result)
+
+
+class RequestTimer:
+    """Учитывает запрос: in-flight, длительность и статус."""
+    __slots__ = ('route', 'started')
+
+    def __init__(self, route):
+        self.route = route
+        self.started = perf_counter()
+        IN_FLIGHT.inc()
+
+    def finish(self, status):
+        REQUEST_DURATION.observe(perf_counter() - self.started, self.route)
+        REQUESTS.inc(self.route, str(status))
+        IN_FLIGHT.dec()
+
+
+class UpstreamTimer:
+    """Учитывает обращение к внешнему API."""
+    __slots__ = ('started',)
+
+    def __enter__(self):
+        self.started = perf_counter()
+        UPSTREAM_IN_FLIGHT.inc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = 'ok' if exc_type is None else 'error'
+        UPSTREAM_DURATION.observe(perf_counter() - self.started, outcome)
+        UPSTREAM_IN_FLIGHT.dec()
+
+
+def instrument_wsgi(app):
+    """Оборачивает WSGI-приложение учётом запросов."""
+    @wraps(app)
+    def wrapper(environ, start_response):
+        timer = RequestTimer(route_label(environ.get('PATH_INFO', '')))
+        status = ['500']
+
+        def recording_start_response(status_line, headers, *exc_info):
+            status[0] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, *exc_info)
+
+        try:
+            body = app(environ, recording_start_response)
+        except BaseException:
+            timer.finish(status[0])
+            raise
+        return _TimedBody(body, timer, status)
+
+    return wrapper
+
+
+class _TimedBody:
+    """
+    Тело WSGI-ответа, которое завершает учёт запроса в close().
+
+    Сервер вызывает close() после отправки последнего куска, так что
+    длительность и in-flight потоковых ответов (/rates) включают отдачу.
+    """
+    __slots__ = ('body', 'timer', 'status')
+
+    def __init__(self, body, timer, status):
+        self.body = body
+        self.timer = timer
+        self.status = status
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.timer.finish(self.status[0])
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+
+class _Entry:
+    """Закэшированное значение и моменты, когда оно устаревает."""
+    __slots__ = ('value', 'fresh_until', 'stale_until')
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class _Flight:
+    """Выполняющийся вызов loader, результата которого ждут остальные промахи."""
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RateCache:
+    """
+    Потокобезопасный кэш курсов с TTL и stale-while-revalidate.
+
+    Запись считается свежей ttl секунд. Ещё stale_ttl секунд после этого
+    она отдаётся клиентам как есть, а обновление идёт в фоновом потоке.
+    Одновременные промахи по одному ключу объединяются в один вызов
+    loader (single-flight), ошибки loader не кэшируются. Если задан
+    on_lookup, он вызывается с 'hit', 'stale' или 'miss' на каждый get.
+    """
+
+    def __init__(self, loader, ttl=60.0, stale_ttl=300.0, clock=time.monotonic, on_lookup=None):
+        self.loader = loader
+        self.on_lookup = on_lookup
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает значение по ключу, при необходимости вызывая loader."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = self._clock()
+            if now < entry.fresh_until:
+                self._count('hit')
+                return entry.value
+            if now < entry.stale_until:
+                self._count('stale')
+                self._refresh_in_background(key)
+                return entry.value
+        self._count('miss')
+        return self._load(key)
+
+    def _count(self, result):
+        if self.on_lookup is not None:
+            self.on_lookup(result)
+
+    def invalidate(self, key):
+        """Удаляет запись из кэша."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Очищает кэш."""
+        self._entries.clear()
+
+    def _load(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            self._run(key, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._flights:
+                return
+            flight = self._flights[key] = _Flight()
+        threading.Thread(target=self._run, args=(key, flight), daemon=True).start()
+
+    def _run(self, key, flight):
+        try:
+            flight.value = self.loader(key)
+        except Exception as e:
+            flight.error = e
+        else:
+            now = self._clock()
+            fresh_until = now + self.ttl
+            self._entries[key] = _Entry(flight.value, fresh_until, fresh_until + self.stale_ttl)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+def _retrieve_error(task):
+    # Ошибку фонового обновления никто не ждёт, помечаем её полученной
+    if not task.cancelled():
+        task.exception()
+
+
+class AsyncRateCache:
+    """
+    Вариант RateCache для asyncio: loader - корутина.
+
+    Одновременные промахи по ключу ждут одну задачу loader, фоновое
+    обновление устаревших записей тоже выполняется отдельной задачей.
+    """
+
+    def __init__(self, loader, ttl=60.0, stale_ttl=300.0, clock=time.monotonic, on_lookup=None):
+        self.loader = loader
+        self.on_lookup = on_lookup
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._entries = {}
+        self._flights = {}
+
+    async def get(self, key):
+        """Возвращает значение по ключу, при необходимости вызывая loader."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            now = self._clock()
+            if now < entry.fresh_until:
+                self._count('hit')
+                return entry.value
+            if now < entry.stale_until:
+                self._count('stale')
+                self._flight(key)
+                return entry.value
+        self._count('miss')
+        # shield: отмена одного ожидающего клиента не отменяет общий запрос
+        return await asyncio.shield(self._flight(key))
+
+    def _count(self, result):
+        if self.on_lookup is not None:
+            self.on_lookup(result)
+
+    def invalidate(self, key):
+        """Удаляет запись из кэша."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """Очищает кэш."""
+        self._entries.clear()
+
+    def _flight(self, key):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(self._run(key))
+            flight.add_done_callback(_retrieve_error)
+        return flight
+
+    async def _run(self, key):
+        try:
+            value = await self.loader(key)
+            now = self._clock()
+            fresh_until = now + self.ttl
+            self._entries[key] = _Entry(value, fresh_until, fresh_until + self.stale_ttl)
+            return value
+        finally:
+            del self._flights[key]
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import json
+import time
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
+
+
+# Меньшие тела не сжимаем: выигрыш меньше заголовков
+MIN_COMPRESS_SIZE = 256
+
+
+@lru_cache(maxsize=256)
+def choose_encoding(accept_encoding):
+    """Выбирает gzip, deflate или None (без сжатия) по заголовку Accept-Encoding."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ('gzip', 'deflate'):
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def _compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    return zlib.compress(body, 9)
+
+
+class RatePayload:
+    """
+    Тело ответа с курсами вместе с валидаторами и сжатыми вариантами.
+
+    ETag и Last-Modified считаются один раз при создании, gzip/deflate
+    варианты и готовые заголовки - при первом запросе и дальше
+    переиспользуются, пока запись живёт в кэше.
+    """
+    __slots__ = ('body', 'etag', 'last_modified', 'timestamp', '_variants')
+
+    def __init__(self, body, timestamp=None):
+        self.body = body
+        self._variants = {}
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        if timestamp is None:
+            timestamp = self._updated_at(body)
+        self.timestamp = int(timestamp)
+        self.last_modified = formatdate(self.timestamp, usegmt=True)
+
+    @staticmethod
+    def _updated_at(body):
+        try:
+            return json.loads(body)['time_last_updated']
+        except (ValueError, KeyError, TypeError):
+            return time.time()
+
+    def variant(self, encoding):
+        """Возвращает (тело, заголовки) для encoding: 'gzip', 'deflate' или None."""
+        variant = self._variants.get(encoding)
+        if variant is None:
+            if encoding is None or len(self.body) < MIN_COMPRESS_SIZE:
+                body = self.body
+                headers = [('ETag', f'"{self.etag}"')]
+            else:
+                body = _compress(self.body, encoding)
+                headers = [('Content-Encoding', encoding), ('ETag', f'"{self.etag}-{encoding}"')]
+            headers += [
+                ('Last-Modified', self.last_modified),
+                ('Vary', 'Accept-Encoding'),
+                ('Content-Length', str(len(body))),
+            ]
+            variant = self._variants[encoding] = (body, headers)
+        return variant
+
+    def not_modified(self, if_none_match, if_modified_since):
+        """Проверяет условия If-None-Match / If-Modified-Since."""
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag.startswith('W/'):
+                    tag = tag[2:]
+                # Сравнение слабое: сжатый вариант совпадает с исходным
+                if tag.strip('"').split('-')[0] == self.etag:
+                    return True
+            return False
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= self.timestamp
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def response(self, accept_encoding=None, if_none_match=None, if_modified_since=None):
+        """
+        Готовый ответ на запрос: (статус, заголовки, тело).
+
+        Заголовки включают ETag, Last-Modified, Vary и Content-Length
+        (кроме ответа 304, у которого тела нет).
+        """
+        encoding = choose_encoding(accept_encoding)
+        body, headers = self.variant(encoding)
+        if self.not_modified(if_none_match, if_modified_since):
+            return 304, headers[:-1], b''
+        return 200, headers, body
@@ -0,0 +1,136 @@
+import json
+import threading
+from array import array
+
+from rate_payload import RatePayload
+
+
+def _round(rate):
+    # Внешний API отдаёт курсы с 4-6 значащими цифрами, больше не придумываем
+    return float(f'{rate:.6g}')
+
+
+class _Snapshot:
+    """
+    Неизменяемый снимок таблицы курсов опорной валюты.
+
+    Курсы хранятся плотным массивом в порядке codes. Строка матрицы
+    кросс-курсов для базы i получается делением всего массива на rates[i];
+    строки и готовые ответы (RatePayload) для них кэшируются до следующего
+    снимка.
+    """
+    __slots__ = ('data', 'codes', 'index', 'rates', '_rows', '_payloads')
+
+    def __init__(self, data):
+        self.data = data
+        self.codes = tuple(data['rates'])
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.rates = array('d', data['rates'].values())
+        self._rows = {}
+        self._payloads = {}
+
+    def cross_rates(self, i):
+        """
+        Строка матрицы кросс-курсов для базы с индексом i.
+
+        Деление идёт циклом Python, без NumPy: прокси не тянет его ради
+        строки из пары сотен валют. Цикл выполняется один раз на базу
+        за снимок, дальше строка берётся из кэша; не изменяйте её.
+        """
+        row = self._rows.get(i)
+        if row is None:
+            pivot = self.rates[i]
+            row = self._rows[i] = array('d', [rate / pivot for rate in self.rates])
+        return row
+
+    def rate_payload(self, currency_code):
+        """Ответ с курсами для базы currency_code или None, если валюта неизвестна."""
+        payload = self._payloads.get(currency_code)
+        if payload is not None:
+            return payload
+
+        i = self.index.get(currency_code)
+        if i is None:
+            return None
+
+        if currency_code == self.data['base']:
+            rates = self.data['rates']
+        else:
+            rates = dict(zip(self.codes, map(_round, self.cross_rates(i))))
+
+        # Сохраняем порядок полей исходного ответа, меняем только базу и курсы
+        result = {}
+        for field, value in self.data.items():
+            if field == 'base':
+                value = currency_code
+            elif field == 'rates':
+                value = rates
+            result[field] = value
+
+        payload = self._payloads[currency_code] = RatePayload(
+            json.dumps(result).encode('utf-8'), timestamp=self.data.get('time_last_updated')
+        )
+        return payload
+
+
+class RateTable:
+    """
+    Курсы для любой базовой валюты из одного снимка опорной валюты.
+
+    Раз в refresh_interval секунд фоновый поток загружает курсы опорной
+    валюты через loader(currency_code) -> bytes, остальные базы считаются
+    локально. Первый запрос ждёт загрузки снимка, дальше запросы к
+    внешнему API не зависят от числа клиентов и валют. Если обновление
+    не удалось, продолжает отдаваться предыдущий снимок.
+    """
+
+    def __init__(self, loader, reference='USD', refresh_interval=60.0):
+        self.loader = loader
+        self.reference = reference
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher = None
+
+    @property
+    def ready(self):
+        """Загружен ли первый снимок."""
+        return self._snapshot is not None
+
+    def rate_payload(self, currency_code):
+        """Возвращает RatePayload с курсами для currency_code или None, если валюта неизвестна."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._warm_up()
+        return snapshot.rate_payload(currency_code)
+
+    def refresh(self):
+        """Загружает новый снимок опорной валюты."""
+        payload = json.loads(self.loader(self.reference))
+        self._snapshot = _Snapshot(payload)
+
+    def start(self):
+        """Запускает фоновое обновление снимка."""
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._refresher.start()
+
+    def stop(self):
+        """Останавливает фоновое обновление."""
+        self._stopped.set()
+
+    def _warm_up(self):
+        with self._lock:
+            if self._snapshot is None:
+                self.refresh()
+        self.start()
+        return self._snapshot
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                pass
@@ -0,0 +1,351 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from rate_cache import RateCache
+
+
+MAGIC = b'RATECCH1'
+# magic, число слотов, размер слота
+FILE_HEADER = struct.Struct('<8sII')
+# seq, ключ, свежо до, можно отдавать до, длина тела
+SLOT_HEADER = struct.Struct('<Q8sddI')
+SEQ = struct.Struct('<Q')
+SEQ_KEY = struct.Struct('<Q8s')
+SLOT_HEADER_SIZE = 40
+# Длина поля ключа в заголовке слота
+KEY_SIZE = 8
+MAX_PROBES = 16
+READ_RETRIES = 100
+
+
+class SharedRateCache:
+    """
+    Кэш курсов в общем memory-mapped файле для всех воркеров на хосте.
+
+    Файл разбит на слоты фиксированного размера, слот выбирается по
+    crc32 ключа с линейным пробированием. Чтение идёт без блокировок
+    по схеме seqlock: писатель делает seq нечётным, пишет запись и снова
+    делает seq чётным, а читатель повторяет чтение, если seq поменялся.
+
+    Обновлять слот может только владелец POSIX-блокировки на его байт
+    (fcntl.lockf), так что на промах или устаревание во всём хосте
+    к loader идёт один процесс, остальные ждут его результата или отдают
+    устаревшую запись. Внутри процесса потоки дополнительно
+    сериализуются обычным Lock, так как lockf действует на процесс целиком.
+    Память и число запросов к внешнему API не растут с числом воркеров.
+
+    loader возвращает байты, которые кладутся в файл. Если задан wrap,
+    get возвращает wrap(body), и результат запоминается в процессе до
+    следующей записи в слот, так что повторные чтения не копируют тело.
+    on_lookup, как и у RateCache, получает 'hit', 'stale' или 'miss'.
+
+    По умолчанию 1024 слота: около 160 валют таблицы курсов занимают
+    меньше шестой части, и пробирование короткое. Ключи, не нашедшие
+    места за MAX_PROBES проб, кэшируются в обычном RateCache процесса.
+    Туда же идут пустые ключи и ключи длиннее KEY_SIZE байт ASCII: поле
+    ключа в слоте фиксированной длины, и обрезанный ключ не совпал бы
+    ни с одним запросом. Коды валют в него помещаются.
+    """
+
+    def __init__(self, path, loader, ttl=60.0, stale_ttl=300.0, slots=1024, slot_size=16384,
+                 clock=time.time, wrap=None, on_lookup=None):
+        self.path = path
+        self.loader = loader
+        self.wrap = wrap
+        self.on_lookup = on_lookup
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.slots = slots
+        self.slot_size = slot_size
+        self.capacity = slot_size - SLOT_HEADER_SIZE
+        self._clock = clock
+        self._local_locks = [threading.Lock() for _ in range(slots)]
+        # slot -> (seq, запись с обёрнутым значением)
+        self._memo = {}
+        # Для ключей, которым не хватило слота: кэш и single-flight внутри процесса
+        self._overflow = RateCache(
+            lambda key: self._wrap(self.loader(key)), ttl=ttl, stale_ttl=stale_ttl, clock=clock,
+            on_lookup=on_lookup
+        )
+
+        size = FILE_HEADER.size + slots * slot_size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Инициализацию файла делает один процесс, остальные ждут на блокировке заголовка
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, FILE_HEADER.size, 0)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._mm = mmap.mmap(self._fd, size)
+            if FILE_HEADER.unpack_from(self._mm, 0) != (MAGIC, slots, slot_size):
+                self._mm[:size] = bytes(size)
+                FILE_HEADER.pack_into(self._mm, 0, MAGIC, slots, slot_size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, FILE_HEADER.size, 0)
+
+    def get(self, key):
+        """Возвращает значение по ключу, при необходимости вызывая loader."""
+        encoded = key.encode('ascii')
+        slot = self._find_slot(encoded)
+        if slot is None:
+            # Таблица переполнена, для этого ключа работаем без общего кэша
+            return self._overflow.get(key)
+
+        record = self._read_wrapped(slot)
+        if record is not None and record[0] == encoded:
+            now = self._clock()
+            if now < record[1]:
+                self._count('hit')
+                return record[3]
+            if now < record[2]:
+                self._count('stale')
+                self._refresh_in_background(key, slot)
+                return record[3]
+        self._count('miss')
+        return self._load(key, slot)
+
+    def _count(self, result):
+        if self.on_lookup is not None:
+            self.on_lookup(result)
+
+    def invalidate(self, key):
+        """Помечает запись устаревшей для всех воркеров."""
+        encoded = key.encode('ascii')
+        slot = self._find_slot(encoded)
+        if slot is None:
+            self._overflow.invalidate(key)
+            return
+        with self._locked(slot):
+            if self._read_key(slot) == encoded:
+                self._write(slot, encoded, b'', 0.0, 0.0)
+
+    def clear(self):
+        """Помечает устаревшими все записи."""
+        self._overflow.clear()
+        for slot in range(self.slots):
+            with self._locked(slot):
+                key = self._read_key(slot)
+                if key:
+                    self._write(slot, key, b'', 0.0, 0.0)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def _offset(self, slot):
+        return FILE_HEADER.size + slot * self.slot_size
+
+    def _find_slot(self, encoded):
+        if not 0 < len(encoded) <= KEY_SIZE:
+            # Ключ не помещается в слот (пустой занял бы свободный слот)
+            return None
+        start = zlib.crc32(encoded) % self.slots
+        for probe in range(MAX_PROBES):
+            slot = (start + probe) % self.slots
+            key = self._read_key(slot)
+            if key is None:
+                # Писатель умер посреди записи: блокировка слота его починит
+                with self._locked(slot):
+                    key = self._read_key(slot)
+            if key == encoded or key == b'':
+                return slot
+        return None
+
+    def _read_key(self, slot):
+        """Читает только ключ слота; None, если писатель так и не закончил запись."""
+        offset = self._offset(slot)
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            seq, key = SEQ_KEY.unpack_from(mm, offset)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            if SEQ.unpack_from(mm, offset)[0] == seq:
+                return key.rstrip(b'\0')
+        return None
+
+    def _read(self, slot):
+        """
+        Читает слот без блокировок: (seq, ключ, свежо до, можно отдавать до, тело).
+
+        None, если писатель так и не закончил запись.
+        """
+        offset = self._offset(slot)
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            seq = SEQ.unpack_from(mm, offset)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            _, key, fresh_until, stale_until, length = SLOT_HEADER.unpack_from(mm, offset)
+            if length > self.capacity:
+                continue
+            start = offset + SLOT_HEADER_SIZE
+            body = mm[start:start + length]
+            if SEQ.unpack_from(mm, offset)[0] == seq:
+                return seq, key.rstrip(b'\0'), fresh_until, stale_until, body
+        return None
+
+    def _write(self, slot, encoded, body, fresh_until, stale_until):
+        offset = self._offset(slot)
+        mm = self._mm
+        seq = SEQ.unpack_from(mm, offset)[0]
+        SEQ.pack_into(mm, offset, seq + 1)
+        SLOT_HEADER.pack_into(mm, offset, seq + 1, encoded, fresh_until, stale_until, len(body))
+        start = offset + SLOT_HEADER_SIZE
+        mm[start:start + len(body)] = body
+        SEQ.pack_into(mm, offset, seq + 2)
+
+    def _recover(self, slot):
+        """
+        Под блокировкой слота: нечётный seq остался от писателя, умершего
+        посреди _write. Запись в слоте недостоверна, слот освобождается.
+        """
+        offset = self._offset(slot)
+        seq = SEQ.unpack_from(self._mm, offset)[0]
+        if seq & 1:
+            SLOT_HEADER.pack_into(self._mm, offset, seq, b'', 0.0, 0.0, 0)
+            SEQ.pack_into(self._mm, offset, seq + 1)
+
+    def _locked(self, slot, blocking=True):
+        return _SlotLock(self, slot, blocking)
+
+    def _load(self, key, slot):
+        with self._locked(slot):
+            # Пока ждали блокировку, запись мог обновить другой воркер
+            encoded = key.encode('ascii')
+            record = self._read_wrapped(slot)
+            if record is not None and record[0] == encoded and self._clock() < record[1]:
+                return record[3]
+            if record is not None and record[0] and record[0] != encoded:
+                # Свободный слот успел занять другой ключ, этот запрос не кэшируем
+                return self._wrap(self.loader(key))
+            return self._store(key, slot)
+
+    def _store(self, key, slot):
+        body = self.loader(key)
+        if len(body) <= self.capacity:
+            now = self._clock()
+            fresh_until = now + self.ttl
+            self._write(slot, key.encode('ascii'), body, fresh_until, fresh_until + self.stale_ttl)
+        return self._wrap(body)
+
+    def _wrap(self, body):
+        return body if self.wrap is None else self.wrap(body)
+
+    def _read_wrapped(self, slot):
+        """Как _read, но с обёрнутым значением; пока seq слота не менялся, берётся из памяти процесса."""
+        seq = SEQ.unpack_from(self._mm, self._offset(slot))[0]
+        memo = self._memo.get(slot)
+        if memo is not None and memo[0] == seq:
+            return memo[1]
+        record = self._read(slot)
+        if record is None:
+            return None
+        seq, key, fresh_until, stale_until, body = record
+        record = (key, fresh_until, stale_until, self._wrap(body))
+        self._memo[slot] = (seq, record)
+        return record
+
+    def _refresh_in_background(self, key, slot):
+        lock = self._locked(slot, blocking=False)
+        if not lock.acquire():
+            # Обновлением уже занят другой поток или воркер
+            return
+
+        def refresh():
+            try:
+                self._store(key, slot)
+            except Exception:
+                pass
+            finally:
+                lock.release()
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+class _SlotLock:
+    """Блокировка слота: Lock внутри процесса и lockf между процессами."""
+
+    def __init__(self, cache, slot, blocking):
+        self.cache = cache
+        self.slot = slot
+        self.blocking = blocking
+
+    def acquire(self):
+        local = self.cache._local_locks[self.slot]
+        if not local.acquire(self.blocking):
+            return False
+        cmd = fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.lockf(self.cache._fd, cmd, 1, self.cache._offset(self.slot))
+        except OSError:
+            local.release()
+            if self.blocking:
+                raise
+            return False
+        self.cache._recover(self.slot)
+        return True
+
+    def release(self):
+        fcntl.lockf(self.cache._fd, fcntl.LOCK_UN, 1, self.cache._offset(self.slot))
+        self.cache._local_locks[self.slot].release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    class RacingBuffer(bytearray):
+        """Копия файла, в которой писатель обновляет слот, пока читатель копирует тело."""
+        race = None
+
+        def __getitem__(self, index):
+            value = super().__getitem__(index)
+            if isinstance(index, slice) and self.race is not None:
+                race, self.race = self.race, None
+                race()
+            return value
+
+    with tempfile.TemporaryDirectory() as directory:
+        loads = []
+
+        def loader(key):
+            loads.append(key)
+            return f'{key}:{len(loads)}'.encode('ascii')
+
+        cache = SharedRateCache(os.path.join(directory, 'rates'), loader, slots=8, slot_size=256)
+        assert cache.get('USD') == b'USD:1' and cache.get('USD') == b'USD:1'
+        slot = cache._find_slot(b'USD')
+
+        # Чтение, которое застало запись, повторяется и отдаёт новое тело, а не старое
+        mapped = cache._mm
+        cache._mm = RacingBuffer(mapped)
+        cache._mm.race = lambda: cache._write(slot, b'USD', b'USD:new', 0.0, 0.0)
+        seq, key, _, _, body = cache._read(slot)
+        assert (key, body) == (b'USD', b'USD:new') and seq == SEQ.unpack_from(cache._mm, cache._offset(slot))[0]
+        cache._mm = mapped
+
+        # Писатель умер посреди записи: seq нечётный, слот чинит следующий владелец блокировки
+        offset = cache._offset(slot)
+        seq = SEQ.unpack_from(cache._mm, offset)[0]
+        SLOT_HEADER.pack_into(cache._mm, offset, seq + 1, b'USD', 0.0, 0.0, 10 ** 6)
+        assert cache._read(slot) is None and cache._read_key(slot) is None
+        assert cache.get('USD') == b'USD:2' and cache.get('USD') == b'USD:2'
+        assert SEQ.unpack_from(cache._mm, offset)[0] % 2 == 0
+
+        # Длинный ключ не обрезается до поля слота, а кэшируется в процессе
+        assert cache.get('USD_TO_EUR') == b'USD_TO_EUR:3' and cache.get('USD_TO_EUR') == b'USD_TO_EUR:3'
+        assert loads == ['USD', 'USD', 'USD_TO_EUR']
+        cache.close()
+    print('ok')
@@ -0,0 +1,263 @@
+import http.client
+import json
+import os
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+from proxy_metrics import REGISTRY, Counter, Gauge, UpstreamTimer
+
+
+API_URL = os.environ.get('EXCHANGE_API_URL', "https://api.exchangerate-api.com/v4/latest/{}")
+API_HEADERS = {'User-Agent': 'CurrencyProxy/1.0'}
+
+# Настройки общего пула соединений к внешнему API
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', 20))
+CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3))
+READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10))
+
+
+class UpstreamError(Exception):
+    """Ошибка при обращении к внешнему API, которую нужно вернуть клиенту."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class PoolTimeout(TimeoutError):
+    """Не дождались свободного соединения в пуле."""
+
+
+class UpstreamResponse:
+    """Прочитанный целиком ответ внешнего сервера."""
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class HostPool:
+    """
+    Пул keep-alive соединений к одному хосту.
+
+    Одновременно открыто не больше maxsize соединений; остальные запросы
+    ждут освобождения до pool_timeout секунд. Свободные соединения
+    переиспользуются в порядке LIFO, чтобы реже натыкаться на закрытые
+    сервером по таймауту простоя.
+    """
+
+    def __init__(self, scheme, host, port, maxsize, connect_timeout, read_timeout, ssl_context):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._ssl_context = ssl_context
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._idle = []
+        self._lock = threading.Lock()
+
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.pool_timeouts = 0
+
+    def acquire(self, timeout):
+        """Берёт свободное соединение или создаёт новое (ещё не подключённое)."""
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.pool_timeouts += 1
+            raise PoolTimeout(f"No free connection to {self.host} within {timeout} s")
+
+        with self._lock:
+            self.in_use += 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.created += 1
+
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.connect_timeout, context=self._ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+
+    def release(self, conn, reusable):
+        """Возвращает соединение в пул или закрывает его."""
+        if not reusable:
+            conn.close()
+        with self._lock:
+            self.in_use -= 1
+            if reusable:
+                self._idle.append(conn)
+            else:
+                self.discarded += 1
+        self._slots.release()
+
+    def connect(self, conn):
+        """Подключается с connect_timeout и переключает сокет на read_timeout."""
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+
+    def close(self):
+        """Закрывает свободные соединения."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Состояние пула для метрик."""
+        with self._lock:
+            return {
+                'max': self.maxsize,
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'pool_timeouts': self.pool_timeouts,
+            }
+
+
+class UpstreamClient:
+    """
+    Потокобезопасный HTTP-клиент с пулом keep-alive соединений на каждый хост.
+
+    Ошибки сети пробрасываются как TimeoutError (включая PoolTimeout),
+    OSError или http.client.HTTPException.
+    """
+
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, pool_timeout=None):
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_timeout = read_timeout if pool_timeout is None else pool_timeout
+        self._ssl_context = ssl.create_default_context()
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None):
+        """Выполняет GET запрос и возвращает UpstreamResponse."""
+        return self.request('GET', url, headers)
+
+    def request(self, method, url, headers=None):
+        parts = urlsplit(url)
+        pool = self._pool_for(parts.scheme, parts.hostname, parts.port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        conn = pool.acquire(self.pool_timeout)
+        reusable = False
+        try:
+            if conn.sock is None:
+                pool.connect(conn)
+                response = self._send(conn, method, target, headers)
+            else:
+                try:
+                    response = self._send(conn, method, target, headers)
+                except (ConnectionError, http.client.RemoteDisconnected):
+                    # Сервер закрыл простаивающее соединение, повторяем на новом
+                    conn.close()
+                    pool.connect(conn)
+                    response = self._send(conn, method, target, headers)
+
+            body = response.read()
+            reusable = not response.will_close
+            return UpstreamResponse(response.status, response.headers, body)
+        finally:
+            pool.release(conn, reusable)
+
+    def stats(self):
+        """Состояние пулов по хостам."""
+        with self._lock:
+            pools = list(self._pools.values())
+        return {f'{pool.scheme}://{pool.host}:{pool.port}': pool.stats() for pool in pools}
+
+    def close(self):
+        """Закрывает все свободные соединения."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    def _pool_for(self, scheme, host, port):
+        if port is None:
+            port = 443 if scheme == 'https' else 80
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = self._pools[key] = HostPool(
+                        scheme, host, port, self.max_per_host,
+                        self.connect_timeout, self.read_timeout, self._ssl_context
+                    )
+        return pool
+
+    @staticmethod
+    def _send(conn, method, target, headers):
+        conn.request(method, target, headers=headers or {})
+        return conn.getresponse()
+
+
+# Общий клиент для всех обработчиков процесса
+client = UpstreamClient()
+
+
+def _pool_metrics():
+    connections = Gauge(
+        'currency_proxy_upstream_pool_connections', 'Upstream pool connections by state.', ('host', 'state')
+    )
+    events = Counter(
+        'currency_proxy_upstream_pool_events_total', 'Upstream pool connection events.', ('host', 'event')
+    )
+    for host, stats in client.stats().items():
+        for state in ('in_use', 'idle', 'max'):
+            connections.inc(host, state, amount=stats[state])
+        for event in ('created', 'reused', 'discarded', 'pool_timeouts'):
+            events.inc(host, event, amount=stats[event])
+    return [connections, events]
+
+
+REGISTRY.register_collector(_pool_metrics)
+
+
+def fetch_rates(currency_code):
+    """Запрашивает курсы у внешнего API и возвращает тело ответа в байтах."""
+    try:
+        with UpstreamTimer():
+            response = client.get(API_URL.format(currency_code), headers=API_HEADERS)
+    except TimeoutError:
+        raise UpstreamError(504, "Request to exchange rate API timed out")
+    except (OSError, http.client.HTTPException) as e:
+        raise UpstreamError(502, f"Cannot connect to exchange rate API: {str(e)}")
+
+    return check_rates_response(currency_code, response.status, response.body)
+
+
+def check_rates_response(currency_code, status, body):
+    """Проверяет ответ внешнего API и возвращает тело с курсами."""
+    if status == 404:
+        raise UpstreamError(404, f"Currency not found: {currency_code}")
+    if status != 200:
+        raise UpstreamError(502, f"External API error: {status}")
+
+    # Проверяем, не является ли ответ ошибкой
+    try:
+        result = json.loads(body)
+    except ValueError:
+        raise UpstreamError(502, "Invalid response from exchange rate API")
+    if 'error' in result and result['error'] == 'Invalid base currency':
+        raise UpstreamError(404, f"Currency not found: {currency_code}")
+
+    return body